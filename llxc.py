@@ -25,17 +25,31 @@
 
 # The little perfectionist in me likes to keep this alphabetical.
 import argparse
+import concurrent.futures
+import configparser
+import curses
+import fcntl
 import glob
 import gettext
+import gzip
+import json
 import os
+import random
+import re
+import stat
 import sys
+import tempfile
 import time
 import tarfile
+import threading
 import shutil
+import socket
+import struct
 import subprocess
 import warnings
 
-if os.getuid():
+# Only when run, importing llxc for its tests must not re-execute anything
+if os.getuid() and __name__ == "__main__":
     opts = os.environ.get('llxcsudo', 'allow,env').split(",")
     if not "deny" in opts:
         cmd = ["sudo"]
@@ -60,11 +74,53 @@ AUTOSTART_PATH = "/etc/lxc/auto/"
 CGROUP_PATH = "/sys/fs/cgroup/"
 ARCHIVE_PATH = CONTAINER_PATH + ".archive/"
 LLXCHOME_PATH = "/var/lib/llxc/"
+IOPOLICY_PATH = "/etc/llxc/iopolicy"
+INDEX_PATH = LLXCHOME_PATH + "index"
+MOUNTINFO_PATH = "/proc/self/mountinfo"
+PLACEMENT_PATH = LLXCHOME_PATH + "placement/"
+SYSFS_CPU_PATH = "/sys/devices/system/cpu/"
+SYSFS_NODE_PATH = "/sys/devices/system/node/"
+SYSFS_NET_PATH = "/sys/class/net/"
+LEASES_PATH = "/var/lib/misc/dnsmasq*.leases"
+IDLE_PATH = LLXCHOME_PATH + "idle/"
+IDLE_LOG = IDLE_PATH + "log"
+DU_CACHE_PATH = LLXCHOME_PATH + "du/"
 
 # Other settings
 
 # 5000 = 5 GiB
 MIN_REQ_DISK_SPACE = 5000
+# create clones the container TEMPLATE_PREFIX + template if there is one,
+# copy on write where the storage allows, instead of running the template
+TEMPLATE_PREFIX = "template-"
+# Seconds to wait for an ephemeral container to get an address
+EPHEMERAL_BOOT_TIMEOUT = 60
+# Containers using less than this share of a single cpu are idle
+IDLE_CPU_SHARE = 0.01
+# Threads used for walking container filesystems
+DU_WORKERS = 16
+# Seconds a walked directory is trusted while its mtime doesn't change
+DU_CACHE_MAX_AGE = 3600
+# Threads copying files when cloning without copy on write storage, and the
+# bytes each of them copies at a time when the kernel can't copy for it
+COPY_WORKERS = 8
+COPY_CHUNK = 8 * 1024 * 1024
+# I/O policy of heavy operations unless IOPOLICY_PATH says otherwise.
+# weight is the blkio weight (10-1000), bps and iops are limits for reads
+# and writes each, cpushares the cpu share, ionice one of IONICE_CLASSES.
+IOPOLICY_DEFAULTS = {"weight": "", "bps": "", "iops": "", "cpushares": "",
+                     "ionice": "idle", "nice": "10"}
+IONICE_CLASSES = {"realtime": "1", "besteffort": "2", "idle": "3"}
+# Seconds to trust the neighbour table before reading it again
+NEIGHBOUR_CACHE_TIME = 10
+# Seconds between rescans of the container list and addresses in 'top',
+# and between disk usage walks of a container
+TOP_SLOW_INTERVAL = 10
+TOP_DISK_INTERVAL = 300
+# Columns of 'top': key, title, width
+TOP_COLUMNS = [("name", "NAME", 20), ("state", "STATE", 9),
+               ("tasks", "TASKS", 7), ("memory", "MEMORY", 13),
+               ("cpu", "CPU%", 8), ("ip", "IP_ADDR", 17), ("disk", "DISK", 13)]
 KERNEL_VERSION = os.popen("uname -r").read().rstrip()
 
 # Set colours, unless llxcmono is set
@@ -86,26 +142,34 @@ except KeyError:
 
 def listing():
     """Provides a list of LXC Containers"""
-    print (_("%s   NAME \tTASKS \t   STATUS \tIP_ADDR_%s%s"
-           % (CYAN, ARGS.interface.swapcase(), NORMAL)))
-    for container in glob.glob(CONTAINER_PATH + '*/config'):
-        containername = container.replace(CONTAINER_PATH, "").rstrip("/config")
+    containernames = list_containers()
+    if ARGS.sort == "disk":
+        print (_("%s   NAME \tTASKS \t   STATUS \tIP_ADDR_%s \tDISK%s"
+               % (CYAN, ARGS.interface.swapcase(), NORMAL)))
+        usage = dict((containername, disk_usage(containername)[0])
+                     for containername in containernames)
+        containernames.sort(key=lambda containername: -usage[containername])
+    else:
+        print (_("%s   NAME \tTASKS \t   STATUS \tIP_ADDR_%s%s"
+               % (CYAN, ARGS.interface.swapcase(), NORMAL)))
+    for containername in containernames:
         cont = lxc.Container(containername)
-        try:
-            ipaddress = cont.get_ips(protocol="ipv4",
-                                     interface="eth0", timeout=0.5)
-            ipaddress = ipaddress[0]
-        except TypeError:
-            ipaddress = "Unavailable"
-        except IndexError:
-            ipaddress = "Unavailable"
+        ipaddress = container_ip(cont, ARGS.ipstack, ARGS.interface)
         try:
             tasks = sum(1 for line in open(CGROUP_PATH + "cpuset/lxc/" +
                         containername + "/tasks", 'r'))
         except IOError:
             tasks = "00"
-        print (_("   %s \t %s \t   %s \t%s" % (containername, tasks,
-               cont.state.swapcase(), ipaddress)))
+        if ARGS.sort == "disk":
+            print (_("   %s \t %s \t   %s \t%s \t%.2f MiB"
+                   % (containername, tasks, cont.state.swapcase(), ipaddress,
+                      usage[containername] / 1000 / 1000)))
+        else:
+            print (_("   %s \t %s \t   %s \t%s" % (containername, tasks,
+                   cont.state.swapcase(), ipaddress)))
+    # States change behind llxc's back, on reboots or shutdowns from inside
+    # a container, listing is when the completion scripts catch up
+    refresh_index()
 
 
 def listarchive():
@@ -128,6 +192,7 @@ def listarchive():
 def status():
     """Prints a status report for specified container"""
     requires_container_existance()
+    thaw_if_idle(CONTAINERNAME)
 
     cont = lxc.Container(CONTAINERNAME)
 
@@ -174,6 +239,8 @@ def status():
     root_fs = cont.get_config_item('lxc.rootfs')
     cpu_set = open(CGROUP_PATH + "cpuset/lxc/" +
                    CONTAINERNAME + "/cpuset.cpus", 'r').read()
+    space_used, free_space = disk_usage(CONTAINERNAME)
+    pool_usage = storage_backend(CONTAINERNAME).pool_usage() or "n/a"
 
     print (_(CYAN + """\
     Status report for container:  """ + CONTAINERNAME + NORMAL + """
@@ -187,8 +254,9 @@ def status():
 
                         STORAGE:
                 Root Filesystem:  %s
-                     Space Used:
-                     Free Space:
+                     Space Used:  %.2f MiB
+                     Free Space:  %.2f MiB
+                Thin Pool Usage:  %s
 
                          MEMORY:
                    Memory Usage:  %.2f MiB
@@ -205,7 +273,8 @@ def status():
               Running processes:  %s
     """ % (lxcversion, lxchost, lxcguest, lxc.arch, config_file,
            console_tty,
-           root_fs,
+           root_fs, space_used / 1000 / 1000, free_space / 1000 / 1000,
+           pool_usage,
            memusage, swap_usage, swappiness,
            cpu_set,
            init_pid, autostart, state, tasks)))
@@ -218,25 +287,8 @@ def status():
         macaddress = cont.network[count].hwaddr
         count = count + 1
 
-    ipaddress = cont.get_ips()
-
-    try:
-        ipaddress = cont.get_ips(protocol="ipv4",
-                                 interface="eth0", timeout=0.5)
-        ip4address = ipaddress[0]
-    except TypeError:
-        ip4address = "Unavailable"
-    except IndexError:
-        ip4address = "Unavailable"
-
-    try:
-        ipaddress = cont.get_ips(protocol="ipv6",
-                                 interface="eth0", timeout=0.5)
-        ip6address = ipaddress[0]
-    except TypeError:
-        ip6address = "Unavailable"
-    except IndexError:
-        ip6address = "Unavailable"
+    ip4address = container_ip(cont, "ipv4", "eth0")
+    ip6address = container_ip(cont, "ipv6", "eth0")
 
     print ("""                     NETWORKING:
          Network Configurations:  %s
@@ -260,6 +312,8 @@ def kill():
     if cont.stop():
         print (_("   %s%s sucessfully killed%s"
                % (GREEN, CONTAINERNAME, NORMAL)))
+    update_index(CONTAINERNAME)
+    remove_if_ephemeral(CONTAINERNAME)
 
 
 def stop():
@@ -282,10 +336,13 @@ def start():
     print (_(" * Starting %s..." % (CONTAINERNAME)))
     requires_network_bridge()
     requires_container_existance()
+    requires_base_not_in_use()
+    place_containers([CONTAINERNAME])
     cont = lxc.Container(CONTAINERNAME)
     if cont.start():
         print (_("   %s%s sucessfully started%s"
                % (GREEN, CONTAINERNAME, NORMAL)))
+    update_index(CONTAINERNAME)
 
 
 def halt():
@@ -297,6 +354,8 @@ def halt():
     if cont.shutdown():
         print (_("   %s%s successfully shut down%s"
                % (GREEN, CONTAINERNAME, NORMAL)))
+    update_index(CONTAINERNAME)
+    remove_if_ephemeral(CONTAINERNAME)
 
 
 def freeze():
@@ -309,6 +368,7 @@ def freeze():
         if cont.freeze():
             print (_("    %scontainer successfully frozen%s"
                    % (GREEN, NORMAL)))
+            update_index(CONTAINERNAME)
         else:
             print (_("    %sERROR:%s Something went wrong,"
                      " please check status."
@@ -327,9 +387,12 @@ def unfreeze():
     if lxc.Container(CONTAINERNAME).state == "FROZEN":
         print (_(" * Unfreezing container: %s..." % (CONTAINERNAME)))
         cont = lxc.Container(CONTAINERNAME)
+        if os.path.exists(IDLE_PATH + "frozen/" + CONTAINERNAME):
+            os.remove(IDLE_PATH + "frozen/" + CONTAINERNAME)
         if cont.unfreeze():
             print (_("    %scontainer successfully unfrozen%s"
                    % (GREEN, NORMAL)))
+            update_index(CONTAINERNAME)
         else:
             print (_("    %sERROR:%s Something went wrong, "
                      "please check status."
@@ -363,7 +426,13 @@ def create():
     requires_container_nonexistance()
     requires_free_disk_space()
     cont = lxc.Container(CONTAINERNAME)
-    if cont.create('ubuntu'):
+    if os.path.exists(CONTAINER_PATH + TEMPLATE_PREFIX + "ubuntu/config"):
+        print (_("   cloning template container %s..."
+                 % (TEMPLATE_PREFIX + "ubuntu")))
+        created = clone_container(TEMPLATE_PREFIX + "ubuntu", CONTAINERNAME)
+    else:
+        created = False
+    if created or cont.create('ubuntu'):
         print (_("   %scontainer %s successfully created%s"
                % (GREEN, CONTAINERNAME, NORMAL)))
     else:
@@ -378,6 +447,10 @@ def destroy():
     """Destroy LXC Container"""
     requires_root()
     requires_container_existance()
+    if is_ephemeral(CONTAINERNAME):
+        kill()
+        return
+    requires_base_not_in_use()
     if lxc.Container(CONTAINERNAME).state == "RUNNING":
         print (_(" * %sWARNING:%s Container is running, stopping before"
                " destroying in 10 seconds..."
@@ -385,10 +458,10 @@ def destroy():
         time.sleep(10)
         kill()
     print (_(" * Destroying container " + CONTAINERNAME + "..."))
-    cont = lxc.Container(CONTAINERNAME)
-    if cont.destroy():
+    if destroy_container(CONTAINERNAME):
         print (_("   %s%s successfully destroyed %s"
                % (GREEN, CONTAINERNAME, NORMAL)))
+        update_index(CONTAINERNAME)
     else:
         print (_("   %sERROR:%s Something went wrong, please check status"
                % (RED, NORMAL)))
@@ -409,7 +482,21 @@ def clone():
         sys.exit(1)
     print (_(" * Cloning %s in to %s..."
            % (CONTAINERNAME, ARGS.newCONTAINERNAME)))
-    if cont.clone(CONTAINERNAME):
+    iopolicy = enter_io_policy("clone")
+    try:
+        copied = clone_container(CONTAINERNAME, ARGS.newCONTAINERNAME)
+        cloned = copied or cont.clone(CONTAINERNAME)
+    finally:
+        leave_io_policy(iopolicy)
+    if cloned:
+        if isinstance(copied, CopyProgress):
+            report_throughput(copied.copied, copied.started)
+            print (_("   %sinfo:%s %d files, %s"
+                     % (CYAN, NORMAL, copied.files, copied.describe())))
+        elif copied:
+            print (_("   %sinfo:%s copy on write snapshot, nothing copied"
+                     % (CYAN, NORMAL)))
+        update_index(ARGS.newCONTAINERNAME)
         print (_("   %scloning operation succeeded%s"
                % (GREEN, NORMAL)))
     else:
@@ -421,31 +508,49 @@ def clone():
 def archive():
     """Archive LXC container by tarring it up and removing it."""
     if not os.path.exists(ARCHIVE_PATH):
-        os.path.mkdir(ARCHIVE_PATH)
+        os.makedirs(ARCHIVE_PATH)
     requires_root()
     requires_container_existance()
-    halt()
+    requires_base_not_in_use()
+    backend = storage_backend(CONTAINERNAME)
+    # With a snapshot the container keeps running while it's being copied,
+    # whatever changes after the snapshot is lost when it's halted after.
+    rootfs = backend.snapshot()
+    if rootfs is None:
+        halt()
+        rootfs = backend.mount()
+    else:
+        print (_("   archiving from a snapshot, %s keeps running until "
+                 "done..." % (CONTAINERNAME)))
     print (_(" * Archiving container: %s..." % (CONTAINERNAME)))
-    previous_path = os.getcwd()
-    os.chdir(CONTAINER_PATH)
-    tar = tarfile.open(ARCHIVE_PATH + CONTAINERNAME + ".tar.gz", "w:gz")
-    tar.add(CONTAINERNAME)
-    tar.close
-    os.chdir(previous_path)
+    iopolicy = enter_io_policy("archive")
+    started = time.time()
+    try:
+        tar = tarfile.open(ARCHIVE_PATH + CONTAINERNAME + ".tar.gz", "w:gz")
+        add_container_to_tar(tar, CONTAINERNAME, rootfs)
+        tar.close()
+    finally:
+        leave_io_policy(iopolicy)
+        if backend.snapshot_path:
+            backend.release_snapshot()
+        else:
+            backend.umount(rootfs)
+    report_throughput(os.path.getsize(ARCHIVE_PATH + CONTAINERNAME +
+                                      ".tar.gz"), started)
     print (_("   %scontainer archived in to %s%s.tar.gz%s"
-           % (GREEN, CONTAINER_PATH, CONTAINERNAME, NORMAL)))
+           % (GREEN, ARCHIVE_PATH, CONTAINERNAME, NORMAL)))
+    if is_container_active(CONTAINERNAME):
+        halt()
     print (_(" * Removing container path %s..."
            % (CONTAINER_PATH + CONTAINERNAME)))
-    if is_path_on_btrfs(CONTAINER_PATH + CONTAINERNAME):
-        print (_("   container is on btrfs, removing subvolume..."))
-        os.popen("btrfs subvolume delete " + CONTAINERNAME + "/rootfs")
-        # Stupid race conditions. There's a delay
-        time.sleep(0.5)
+    print (_("   removing %s storage..." % (backend.name)))
+    backend.destroy()
     if os.path.isdir(CONTAINER_PATH + CONTAINERNAME):
         shutil.rmtree(CONTAINER_PATH + CONTAINERNAME)
     if os.path.lexists(AUTOSTART_PATH + CONTAINERNAME):
         print (_(" * Autostart was enabled for this container, disabling..."))
         os.remove(AUTOSTART_PATH + CONTAINERNAME)
+    update_index(CONTAINERNAME)
     print (_("   %sarchiving operation complete%s"
            % (GREEN, NORMAL)))
 
@@ -462,15 +567,28 @@ def unarchive():
     # If we're on btrfs we should create a subvolume
     if is_path_on_btrfs(CONTAINER_PATH):
         print ("   container path is on btrfs, creating subvolume...")
-        os.popen("btrfs subvolume create " + CONTAINERNAME)
+        os.makedirs(CONTAINER_PATH + CONTAINERNAME)
+        subprocess.call(["btrfs", "subvolume", "create",
+                         CONTAINER_PATH + CONTAINERNAME + "/rootfs"],
+                        stdout=subprocess.DEVNULL)
+    iopolicy = enter_io_policy("unarchive")
+    started = time.time()
     previous_path = os.getcwd()
-    os.chdir(CONTAINER_PATH)
-    tar = tarfile.open(ARCHIVE_PATH + CONTAINERNAME + ".tar.gz", "r:gz")
-    tar.extractall()
-    os.chdir(previous_path)
+    try:
+        os.chdir(CONTAINER_PATH)
+        tar = tarfile.open(ARCHIVE_PATH + CONTAINERNAME + ".tar.gz", "r:gz")
+        tar.extractall()
+        tar.close()
+    finally:
+        os.chdir(previous_path)
+        leave_io_policy(iopolicy)
+    use_unpacked_rootfs(CONTAINERNAME)
+    report_throughput(os.path.getsize(ARCHIVE_PATH + CONTAINERNAME +
+                                      ".tar.gz"), started)
     print (_("   %stip:%s archive file not removed, container not started,\n"
            "        autostart not restored automatically."
            % (CYAN, NORMAL)))
+    update_index(CONTAINERNAME)
     print (_("   %scontainer unarchived%s" % (GREEN, NORMAL)))
 
 
@@ -481,8 +599,12 @@ def startall():
     for container in glob.glob(CONTAINER_PATH + '*/config'):
         global CONTAINERNAME
         CONTAINERNAME = container.replace(CONTAINER_PATH, "").rstrip("/config")
-        if lxc.Container(CONTAINERNAME).state.swapcase() == "stopped":
+        if ephemerals_on(CONTAINERNAME):
+            print (_("   %swarning:%s %s is the base of ephemeral containers, "
+                     "skipped" % (YELLOW, NORMAL, CONTAINERNAME)))
+        elif lxc.Container(CONTAINERNAME).state.swapcase() == "stopped":
             start()
+    refresh_index()
 
 
 def runinall():
@@ -491,6 +613,7 @@ def runinall():
     for container in glob.glob(CONTAINER_PATH + '*/config'):
         global CONTAINERNAME
         CONTAINERNAME = container.replace(CONTAINER_PATH, "").rstrip("/config")
+        thaw_if_idle(CONTAINERNAME)
         if lxc.Container(CONTAINERNAME).state.swapcase() == "running":
             print (_(" * Executing %s in %s..." % (' '.join(ARGS.command),
                      CONTAINERNAME)))
@@ -581,6 +704,7 @@ def update_sshkeys():
 
 def execute():
     """Execute a command in a container via SSH"""
+    thaw_if_idle(CONTAINERNAME)
     print (_(" * Executing '%s' in %s..." % (' '.join(ARGS.command),
                                              CONTAINERNAME)))
     return_code = subprocess.call("ssh %s %s" %
@@ -595,6 +719,7 @@ def execute():
 
 def enter():
     """Enter a container via SSH"""
+    thaw_if_idle(CONTAINERNAME)
     print (_(" * Entering container %s..." % (CONTAINERNAME)))
     return_code = subprocess.call("ssh %s -i %s" %
                                   (CONTAINERNAME,
@@ -692,6 +817,7 @@ def printconfig():
 def console():
     """Attaches to an LXC console"""
     requires_container_existance()
+    thaw_if_idle(CONTAINERNAME)
     print (_(" * Entering LXC Console: %s" % (CONTAINERNAME)))
     cont = lxc.Container(CONTAINERNAME)
     if cont.console():
@@ -700,6 +826,2489 @@ def console():
         print (_("   %serror:%s please check status" % (RED, NORMAL)))
 
 
+def rebalance():
+    """Re-pin all running containers according to their cpu class"""
+    requires_root()
+    print (_(" * Rebalancing running containers over available cpus..."))
+    plan = place_containers([])
+    for containername in sorted(plan):
+        print (_("   %s%s%s \tcpus: %s \tmems: %s"
+                 % (GREEN, containername, NORMAL,
+                    format_cpulist(plan[containername][0]),
+                    format_cpulist(plan[containername][1]))))
+
+
+def cpuclass():
+    """Sets the cpu placement class and weight of a container"""
+    requires_root()
+    requires_container_existance()
+    if ARGS.weight < 1:
+        print (_("   %serror:%s weight must be at least 1" % (RED, NORMAL)))
+        sys.exit(1)
+    if not os.path.exists(PLACEMENT_PATH):
+        os.makedirs(PLACEMENT_PATH)
+    print (_("   %saction:%s setting cpu class of %s to %s (weight %s)..."
+             % (GREEN, NORMAL, CONTAINERNAME, ARGS.cpuclass, ARGS.weight)))
+    with open(PLACEMENT_PATH + CONTAINERNAME, "w") as placement:
+        placement.write("%s %s\n" % (ARGS.cpuclass, ARGS.weight))
+    print (_("   %stip:%s run 'llxc rebalance' to apply it to running "
+             "containers" % (CYAN, NORMAL)))
+
+
+def idlewatch():
+    """Freezes running containers that have been idle for too long"""
+    requires_root()
+    if not os.path.exists(IDLE_PATH + "frozen/"):
+        os.makedirs(IDLE_PATH + "frozen/")
+    excluded = set(ARGS.exclude)
+    try:
+        excluded.update(open(IDLE_PATH + "exclude").read().split())
+    except IOError:
+        pass
+    print (_(" * Freezing containers idle for longer than %s seconds..."
+             % (ARGS.threshold)))
+    if excluded:
+        print (_("   %sinfo:%s never freezing: %s"
+                 % (CYAN, NORMAL, " ".join(sorted(excluded)))))
+    # name: (last activity sample, time of sample, idle since)
+    samples = {}
+    while True:
+        for containername in list_containers():
+            if (containername in excluded or
+                    read_freezer_state(containername) != "THAWED"):
+                samples.pop(containername, None)
+                continue
+            now = time.time()
+            sample = sample_activity(containername)
+            previous = samples.get(containername)
+            if previous is None or is_busy(previous[0], sample,
+                                           now - previous[1]):
+                samples[containername] = (sample, now, now)
+                continue
+            samples[containername] = (sample, now, previous[2])
+            if now - previous[2] >= ARGS.threshold:
+                idle_freeze(containername, now - previous[2])
+                samples.pop(containername)
+        time.sleep(ARGS.interval)
+
+
+def du():
+    """Prints the disk usage of all containers"""
+    print (_("%s   NAME \t      USED \t      FREE%s" % (CYAN, NORMAL)))
+    usage = dict((containername, disk_usage(containername))
+                 for containername in list_containers())
+    for containername in sorted(usage, key=lambda name: -usage[name][0]):
+        print (_("   %s \t%10.2f MiB \t%10.2f MiB"
+                 % (containername, usage[containername][0] / 1000 / 1000,
+                    usage[containername][1] / 1000 / 1000)))
+    print (_("   %stotal:%s \t%10.2f MiB"
+             % (CYAN, NORMAL,
+                sum(used for used, free in usage.values()) / 1000 / 1000)))
+
+
+def backup():
+    """Back up containers, autostart links and ssh keys to a directory.
+
+    If the previous run to the destination was interrupted, containers it
+    already finished according to the manifest are skipped, unless
+    --fresh is given. Any other run backs up everything again, and with
+    --all or --fresh drops containers it doesn't back up from the
+    destination."""
+    requires_root()
+    if ARGS.all:
+        containernames = list_containers()
+    elif ARGS.containers:
+        containernames = ARGS.containers
+        for containername in containernames:
+            if not os.path.exists(CONTAINER_PATH + containername):
+                print (_("   %serror 404:%s That container (%s) "
+                         "could not be found." % (RED, NORMAL, containername)))
+                sys.exit(404)
+    else:
+        print (_("   %serror 400:%s Specify containers or use --all."
+                 % (RED, NORMAL)))
+        sys.exit(400)
+    destination = os.path.abspath(ARGS.destination) + "/"
+    if not os.path.exists(destination + "containers/"):
+        os.makedirs(destination + "containers/")
+    manifest = read_manifest(destination)
+    if ARGS.fresh or manifest.get("complete", True):
+        manifest["run"] = time.time()
+        manifest["complete"] = False
+        if ARGS.all or ARGS.fresh:
+            # Containers destroyed since must not come back on restore
+            for containername in (set(manifest["containers"]) -
+                                  set(containernames)):
+                del manifest["containers"][containername]
+                tarball = (destination + "containers/" + containername +
+                           ".tar.gz")
+                if os.path.exists(tarball):
+                    os.remove(tarball)
+            write_manifest(destination, manifest)
+    else:
+        print (_("   resuming the interrupted backup started %s..."
+                 % (time.ctime(manifest["run"]))))
+    lock = threading.Lock()
+    limiter = RateLimiter(ARGS.bwlimit * 1000 * 1000)
+    print (_(" * Backing up %s containers to %s..."
+             % (len(containernames), destination)))
+    iopolicy = enter_io_policy("backup")
+    started = time.time()
+    written = []
+    halted = []
+
+    def worker(containername):
+        """Backs up one container and records it in the manifest"""
+        entry = manifest["containers"].get(containername, {})
+        tarball = destination + "containers/" + containername + ".tar.gz"
+        if (entry.get("done") and entry.get("run") == manifest["run"] and
+                os.path.exists(tarball)):
+            print (_("   %s already backed up, skipped..." % (containername)))
+            return
+        started = time.time()
+        size = backup_container(containername, tarball, limiter, halted,
+                                ARGS.online)
+        written.append(size)
+        with lock:
+            manifest["containers"][containername] = {
+                "done": True, "size": size, "finished": time.time(),
+                "run": manifest["run"],
+                "autostart": os.path.lexists(AUTOSTART_PATH + containername)}
+            write_manifest(destination, manifest)
+        print (_("   %s%s backed up%s, %.2f MiB in %.1f seconds"
+                 % (GREEN, containername, NORMAL, size / 1000 / 1000,
+                    time.time() - started)))
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(ARGS.jobs) as pool:
+            for future in [pool.submit(worker, containername)
+                           for containername in containernames]:
+                future.result()
+    finally:
+        leave_io_policy(iopolicy)
+        # Started outside the policy, they would inherit it otherwise
+        for containername in halted:
+            print (_("   starting %s again..." % (containername)))
+            lxc.Container(containername).start()
+    report_throughput(sum(written), started)
+    # Autostart may have changed for containers finished in an earlier run
+    for containername, entry in manifest["containers"].items():
+        entry["autostart"] = os.path.lexists(AUTOSTART_PATH + containername)
+    if os.path.isdir(LLXCHOME_PATH + "ssh"):
+        if os.path.isdir(destination + "ssh"):
+            shutil.rmtree(destination + "ssh")
+        shutil.copytree(LLXCHOME_PATH + "ssh", destination + "ssh")
+        manifest["ssh"] = True
+    manifest["complete"] = True
+    write_manifest(destination, manifest)
+    print (_("   %sbackup operation complete%s" % (GREEN, NORMAL)))
+
+
+def restore():
+    """Restore containers, autostart links and ssh keys from a backup.
+
+    Containers that already exist are left alone, so an interrupted restore
+    can simply be run again."""
+    requires_root()
+    source = os.path.abspath(ARGS.source) + "/"
+    manifest = read_manifest(source)
+    if not manifest["containers"]:
+        print (_("   %serror 404:%s No backup manifest found in %s"
+                 % (RED, NORMAL, source)))
+        sys.exit(404)
+    limiter = RateLimiter(ARGS.bwlimit * 1000 * 1000)
+    print (_(" * Restoring %s containers from %s..."
+             % (len(manifest["containers"]), source)))
+    iopolicy = enter_io_policy("restore")
+    started = time.time()
+    restored = []
+
+    def worker(containername):
+        """Restores one container and its autostart link"""
+        entry = manifest["containers"][containername]
+        if os.path.exists(CONTAINER_PATH + containername):
+            print (_("   %s already exists, skipped..." % (containername)))
+        else:
+            started = time.time()
+            restore_container(containername, source + "containers/" +
+                              containername + ".tar.gz", limiter)
+            restored.append(entry["size"])
+            print (_("   %s%s restored%s in %.1f seconds"
+                     % (GREEN, containername, NORMAL, time.time() - started)))
+        if (entry.get("autostart") and
+                not os.path.lexists(AUTOSTART_PATH + containername)):
+            os.symlink(CONTAINER_PATH + containername,
+                       AUTOSTART_PATH + containername)
+
+    try:
+        with concurrent.futures.ThreadPoolExecutor(ARGS.jobs) as pool:
+            for future in [pool.submit(worker, containername)
+                           for containername in
+                           sorted(manifest["containers"])
+                           if manifest["containers"][containername].get(
+                               "done")]:
+                future.result()
+    finally:
+        leave_io_policy(iopolicy)
+    report_throughput(sum(restored), started)
+    if manifest.get("ssh"):
+        if os.path.exists(LLXCHOME_PATH + "ssh/container_rsa"):
+            print (_("   %swarning:%s existing ssh keypair kept, the backed "
+                     "up one is in %sssh" % (YELLOW, NORMAL, source)))
+        else:
+            if os.path.isdir(LLXCHOME_PATH + "ssh"):
+                shutil.rmtree(LLXCHOME_PATH + "ssh")
+            shutil.copytree(source + "ssh", LLXCHOME_PATH + "ssh")
+    refresh_index()
+    print (_("   %srestore operation complete%s" % (GREEN, NORMAL)))
+
+
+def top():
+    """Live dashboard of all containers"""
+    curses.wrapper(run_top)
+
+
+def apply():
+    """Brings containers in to the states described by a manifest.
+
+    Containers are stopped, frozen and destroyed in reverse dependency
+    order first, then created, configured and started in dependency
+    order. Containers at the same level are handled concurrently."""
+    requires_root()
+    manifest = read_manifest_file(ARGS.manifest)
+    levels = dependency_levels(manifest)
+    plan = plan_changes(manifest)
+    if not plan:
+        print (_("   %snothing to do,%s all containers are in the desired "
+                 "state" % (GREEN, NORMAL)))
+        return
+    print (_(" * Plan for %s:" % (ARGS.manifest)))
+    for level in levels:
+        for containername in level:
+            if containername in plan:
+                print (_("   %s%s:%s %s"
+                         % (CYAN, containername, NORMAL,
+                            ", ".join(" ".join(str(part) for part in action)
+                                      for action in plan[containername][0] +
+                                      plan[containername][1]))))
+    if ARGS.dry_run:
+        return
+    failed = []
+    with concurrent.futures.ThreadPoolExecutor(ARGS.jobs) as pool:
+        for phase, ordered in ((0, reversed(levels)), (1, levels)):
+            for level in ordered:
+                # Dependents of a container that failed are not started.
+                # Levels come in dependency order, so this is transitive.
+                for containername in level:
+                    if (phase and set(manifest[containername]["depends"]) &
+                            set(failed)):
+                        failed.append(containername)
+                futures = dict((pool.submit(perform_actions, containername,
+                                            plan[containername][phase]),
+                                containername)
+                               for containername in level
+                               if containername in plan and
+                               containername not in failed and
+                               plan[containername][phase])
+                for future in concurrent.futures.as_completed(futures):
+                    if not future.result():
+                        failed.append(futures[future])
+    refresh_index()
+    if any(action[0] == "create" for down, up in plan.values()
+           for action in up) and os.path.exists(LLXCHOME_PATH +
+                                                "ssh/container_rsa.pub"):
+        update_sshkeys()
+    if failed:
+        print (_("   %serror:%s not converged: %s"
+                 % (RED, NORMAL, " ".join(sorted(set(failed))))))
+        sys.exit(1)
+    print (_("   %sall containers are in the desired state%s"
+             % (GREEN, NORMAL)))
+
+
+def ephemeral():
+    """Starts a throwaway container on top of a stopped base container.
+
+    Its root filesystem is an overlay of its own over the base's, removed
+    again when it's halted, or right after running --cmd if given."""
+    global CONTAINERNAME
+    requires_root()
+    requires_container_existance()
+    base = CONTAINERNAME
+    if isinstance(storage_backend(base), LvmStorage):
+        print (_("   %serror:%s ephemeral containers need a base with a "
+                 "directory or btrfs root filesystem" % (RED, NORMAL)))
+        sys.exit(1)
+    if is_container_active(base):
+        print (_("   %serror:%s %s is running, a base container has to stay "
+                 "stopped while it's in use" % (RED, NORMAL, base)))
+        sys.exit(1)
+    containername = ARGS.name or "%s-%06x" % (base, random.getrandbits(24))
+    if os.path.exists(CONTAINER_PATH + containername):
+        print (_("   %serror:%s That container already exists."
+                 % (RED, NORMAL)))
+        sys.exit(1)
+    print (_(" * Creating ephemeral container %s on %s..."
+             % (containername, base)))
+    if not create_ephemeral(base, containername):
+        print (_("   %serror:%s could not mount the overlay, please check "
+                 "that the kernel supports overlayfs" % (RED, NORMAL)))
+        sys.exit(1)
+    CONTAINERNAME = containername
+    if not ARGS.cmd:
+        start()
+        print (_("   %stip:%s it's removed when halted or killed"
+                 % (CYAN, NORMAL)))
+        return
+    # Also removed on errors and Ctrl-C, nobody else would remove it
+    try:
+        start()
+        cont = lxc.Container(containername)
+        deadline = time.time() + EPHEMERAL_BOOT_TIMEOUT
+        ipaddress = container_ip(cont)
+        while ipaddress == "Unavailable" and time.time() < deadline:
+            time.sleep(0.5)
+            ipaddress = container_ip(cont)
+        if ipaddress == "Unavailable":
+            print (_("   %serror:%s %s got no address within %s seconds"
+                     % (RED, NORMAL, containername,
+                        EPHEMERAL_BOOT_TIMEOUT)))
+            return_code = 1
+        else:
+            print (_(" * Executing '%s' in %s..." % (' '.join(ARGS.cmd),
+                                                     containername)))
+            # Every ephemeral container gets new addresses, don't remember
+            # them
+            return_code = subprocess.call(
+                ["ssh", "-i", LLXCHOME_PATH + "ssh/container_rsa",
+                 "-o", "StrictHostKeyChecking=no",
+                 "-o", "UserKnownHostsFile=/dev/null", ipaddress] + ARGS.cmd)
+            if not return_code == 0:
+                print (_("    %swarning:%s last exit code in container: %s"
+                         % (YELLOW, NORMAL, return_code)))
+    finally:
+        kill()
+    sys.exit(return_code)
+
+
+def copybench():
+    """Times the copy engine against the copies clone made before it, on a
+    synthetic tree, and checks what they kept of it"""
+    requires_root()
+    workdir = tempfile.mkdtemp(prefix=".copybench-", dir=ARGS.path)
+    source = workdir + "/source"
+    try:
+        print (_(" * Creating %s files in %s..." % (ARGS.files, source)))
+        size = make_synthetic_tree(source, ARGS.files, ARGS.size * 1024)
+        expected = tree_signature(source)
+        candidates = []
+        if shutil.which("rsync"):
+            # What lxc-clone does for directories
+            candidates.append(("rsync", lambda destination:
+                               subprocess.check_call(
+                                   ["rsync", "-aHAXx", "--numeric-ids",
+                                    source + "/", destination])))
+        candidates.append(("shutil.copytree", lambda destination:
+                           shutil.copytree(source, destination,
+                                           symlinks=True,
+                                           ignore=special_files)))
+        candidates.append(("llxc, 1 thread", lambda destination:
+                           copy_tree(source, destination, 1)))
+        candidates.append(("llxc, %s threads" % ARGS.jobs,
+                           lambda destination:
+                           copy_tree(source, destination, ARGS.jobs)))
+        print (_("%s   METHOD \t\t   SECONDS \t     MiB/s \tCOPY%s"
+                 % (CYAN, NORMAL)))
+        for number, (name, copy) in enumerate(candidates):
+            destination = "%s/copy%s" % (workdir, number)
+            if ARGS.cold:
+                os.sync()
+                try:
+                    with open("/proc/sys/vm/drop_caches", "w") as caches:
+                        caches.write("3\n")
+                except IOError:
+                    print (_("   %swarning:%s could not drop the page cache"
+                             % (YELLOW, NORMAL)))
+            started = time.time()
+            result = copy(destination)
+            duration = max(time.time() - started, 0.001)
+            if tree_signature(destination) == expected:
+                kept = _("identical")
+            else:
+                kept = _("%sdiffers%s" % (YELLOW, NORMAL))
+            if isinstance(result, CopyProgress):
+                kept += ", " + result.describe()
+            print (_("   %-15s \t%10.2f \t%10.2f \t%s"
+                     % (name, duration, size / 1000 / 1000 / duration,
+                        kept)))
+            shutil.rmtree(destination)
+    finally:
+        shutil.rmtree(workdir)
+
+
+# Helpers
+
+def list_containers():
+    """Returns the sorted names of all defined containers"""
+    return sorted(os.path.basename(os.path.dirname(container))
+                  for container in glob.glob(CONTAINER_PATH + '*/config'))
+
+
+def is_container_active(containername, cgroup_path=CGROUP_PATH):
+    """Check whether a container has cgroups, ie. is running or frozen"""
+    return os.path.isdir(cgroup_path + "cpuset/lxc/" + containername)
+
+
+def read_config_value(containername, key):
+    """Returns the last value of a key in a container's config file"""
+    value = None
+    try:
+        for line in open(CONTAINER_PATH + containername + "/config"):
+            if line.partition("=")[0].strip() == key:
+                value = line.partition("=")[2].strip()
+    except IOError:
+        pass
+    return value
+
+
+# One lock per config file, set_config_value runs in threads in 'apply'
+CONFIG_LOCKS = {}
+CONFIG_LOCKS_LOCK = threading.Lock()
+
+
+def set_config_value(containername, key, value):
+    """Sets a key in a container's config file, replacing earlier values.
+
+    lxc's set_config_item adds another line for cgroup keys every time,
+    so those are edited here instead."""
+    config = CONTAINER_PATH + containername + "/config"
+    with CONFIG_LOCKS_LOCK:
+        lock = CONFIG_LOCKS.setdefault(config, threading.Lock())
+    with lock:
+        lines = [line for line in open(config)
+                 if line.partition("=")[0].strip() != key]
+        if lines and not lines[-1].endswith("\n"):
+            lines[-1] += "\n"
+        lines.append("%s = %s\n" % (key, value))
+        descriptor, temporary = tempfile.mkstemp(
+            prefix=".config.", dir=CONTAINER_PATH + containername)
+        with os.fdopen(descriptor, "w") as config_file:
+            config_file.writelines(lines)
+        shutil.copymode(config, temporary)
+        os.rename(temporary, config)
+
+
+def container_state(containername):
+    """Returns RUNNING, FROZEN or STOPPED from the cgroups, which is much
+    cheaper than asking lxc"""
+    freezer_state = read_freezer_state(containername)
+    if freezer_state in ("FROZEN", "FREEZING"):
+        return "FROZEN"
+    elif freezer_state or is_container_active(containername):
+        return "RUNNING"
+    return "STOPPED"
+
+
+# Name index for shell completion
+
+def index_lines(name):
+    """Returns the index lines of a container and of its archive"""
+    lines = []
+    if os.path.exists(CONTAINER_PATH + name + "/config"):
+        lines.append("container %s %s\n" % (name, container_state(name)))
+    if os.path.exists(ARCHIVE_PATH + name + ".tar.gz"):
+        lines.append("archive %s\n" % (name))
+    return lines
+
+
+def lock_index():
+    """Returns the lock file of the index, locked until it is closed. The
+    index is read, changed and written while holding it, by any llxc
+    process or thread."""
+    os.makedirs(LLXCHOME_PATH, exist_ok=True)
+    lock = open(INDEX_PATH + ".lock", "a")
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+
+def write_index(lines):
+    """Replaces the index atomically, readable by everyone. The caller
+    holds lock_index."""
+    descriptor, temporary = tempfile.mkstemp(prefix=".index.",
+                                             dir=LLXCHOME_PATH)
+    with os.fdopen(descriptor, "w") as index:
+        index.writelines(sorted(lines))
+    os.chmod(temporary, 0o644)
+    os.rename(temporary, INDEX_PATH)
+
+
+def all_index_lines():
+    """Returns the index lines of all containers and archives"""
+    names = set(list_containers())
+    names.update(os.path.basename(archive)[:-len(".tar.gz")]
+                 for archive in glob.glob(ARCHIVE_PATH + "*.tar.gz"))
+    return [line for name in names for line in index_lines(name)]
+
+
+def refresh_index():
+    """Rebuilds the index of containers, their states and archives.
+
+    The bash and zsh completion scripts read it instead of running llxc,
+    which would import lxc and possibly ask for a sudo password."""
+    with lock_index():
+        write_index(all_index_lines())
+
+
+def update_index(name):
+    """Updates the index lines of one container after it changed"""
+    with lock_index():
+        try:
+            lines = open(INDEX_PATH).readlines()
+        except IOError:
+            write_index(all_index_lines())
+            return
+        lines = [line for line in lines if line.split()[1:2] != [name]]
+        write_index(lines + index_lines(name))
+
+
+# Disk usage
+
+def btrfs_usage(path):
+    """Returns the bytes referenced by a btrfs subvolume according to its
+    qgroup, or None if quotas aren't enabled"""
+    try:
+        output = subprocess.check_output(["btrfs", "qgroup", "show", "-f",
+                                          "--raw", path],
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    for line in output.decode().splitlines():
+        fields = line.split()
+        if len(fields) >= 2 and "/" in fields[0] and fields[1].isdigit():
+            return int(fields[1])
+    return None
+
+
+def lvm_usage(device):
+    """Returns (used, free) bytes of a logical volume. For thin volumes the
+    used space is what has been allocated from the pool"""
+    output = os.popen("lvs --noheadings --nosuffix --units b "
+                      "-o lv_size,data_percent " + device).read().split()
+    if not output:
+        return 0, 0
+    size = int(float(output[0]))
+    if len(output) > 1:
+        used = int(size * float(output[1].replace(",", ".")) / 100)
+    else:
+        used = size
+    return used, size - used
+
+
+def scan_directory(path, device, entry):
+    """Lists one directory for walk_usage.
+
+    entry is the cached [mtime, bytes, subdirectories, time listed] of the
+    directory and is returned as is if the directory has not changed since
+    and was listed less than DU_CACHE_MAX_AGE ago. Returns (path, entry),
+    entry is None when the directory has vanished."""
+    try:
+        stat = os.lstat(path)
+        if (entry is not None and len(entry) > 3 and
+                entry[0] == stat.st_mtime_ns and
+                time.time() - entry[3] < DU_CACHE_MAX_AGE):
+            return path, entry
+        size = stat.st_blocks * 512
+        subdirs = []
+        for item in os.scandir(path):
+            itemstat = item.stat(follow_symlinks=False)
+            if item.is_dir(follow_symlinks=False):
+                if itemstat.st_dev == device:
+                    subdirs.append(item.path)
+            else:
+                # Hard links share their blocks between all their names
+                size += itemstat.st_blocks * 512 // itemstat.st_nlink
+        return path, [stat.st_mtime_ns, size, subdirs, time.time()]
+    except OSError:
+        return path, None
+
+
+def walk_usage(path, cache):
+    """Adds up the disk usage of a directory tree using a pool of threads.
+
+    cache maps directories to the entries of a previous walk. Directories
+    whose mtime is unchanged are not listed again, only their
+    subdirectories are checked. Files that changed size in place don't
+    change their directory's mtime, so directories are listed again once
+    their entry is DU_CACHE_MAX_AGE old. Returns (bytes, new cache)."""
+    device = os.lstat(path).st_dev
+    fresh = {}
+    total = 0
+    with concurrent.futures.ThreadPoolExecutor(DU_WORKERS) as pool:
+        pending = set([pool.submit(scan_directory, path, device,
+                                   cache.get(path))])
+        while pending:
+            done, pending = concurrent.futures.wait(
+                pending, return_when=concurrent.futures.FIRST_COMPLETED)
+            for future in done:
+                directory, entry = future.result()
+                if entry is None:
+                    continue
+                fresh[directory] = entry
+                total += entry[1]
+                for subdir in entry[2]:
+                    pending.add(pool.submit(scan_directory, subdir, device,
+                                            cache.get(subdir)))
+    return total, fresh
+
+
+def disk_usage(containername):
+    """Returns (used, free) bytes for a container's root filesystem.
+
+    LVM volumes and btrfs subvolumes with quotas are asked directly, other
+    filesystems are walked with the results cached in DU_CACHE_PATH."""
+    return storage_backend(containername).usage()
+
+
+# Copy engine
+
+# ioctl sharing the extents of one file with another, on btrfs and xfs
+FICLONE = 0x40049409
+
+
+class CopyProgress(object):
+    """Files and bytes copied so far by copy_tree, shared by its workers"""
+
+    def __init__(self, total):
+        self.total = total
+        self.copied = 0
+        self.files = 0
+        self.started = time.time()
+        self.lock = threading.Lock()
+        # Methods that failed once are not tried again
+        self.methods = {"reflink": True,
+                        "copy_file_range": hasattr(os, "copy_file_range")}
+        self.used = {}
+
+    def add(self, size, method):
+        """Counts a copied file"""
+        with self.lock:
+            self.copied += size
+            self.files += 1
+            self.used[method] = self.used.get(method, 0) + 1
+
+    def report(self, end=False):
+        """Updates the progress line on a terminal"""
+        if not sys.stdout.isatty():
+            return
+        duration = max(time.time() - self.started, 0.001)
+        sys.stdout.write(_("\r   copying: %.2f of %.2f MiB, %d files, "
+                           "%.2f MiB/s  "
+                           % (self.copied / 1000 / 1000,
+                              self.total / 1000 / 1000, self.files,
+                              self.copied / 1000 / 1000 / duration)))
+        if end:
+            sys.stdout.write("\n")
+        sys.stdout.flush()
+
+    def describe(self):
+        """Says how the files were copied"""
+        return ", ".join("%d by %s" % (self.used[method], method)
+                         for method in sorted(self.used)) or "none"
+
+
+def copy_metadata(source, path, status):
+    """Gives path the owner, mode, extended attributes and times of source,
+    whose lstat is status. In that order, as chown clears setuid bits and
+    file capabilities."""
+    symlink = stat.S_ISLNK(status.st_mode)
+    os.lchown(path, status.st_uid, status.st_gid)
+    if not symlink:
+        os.chmod(path, stat.S_IMODE(status.st_mode))
+    try:
+        attributes = os.listxattr(source, follow_symlinks=False)
+    except OSError:
+        attributes = []
+    for attribute in attributes:
+        try:
+            os.setxattr(path, attribute,
+                        os.getxattr(source, attribute, follow_symlinks=False),
+                        follow_symlinks=False)
+        except OSError:
+            # Eg. user attributes can't be set on symlinks
+            pass
+    os.utime(path, ns=(status.st_atime_ns, status.st_mtime_ns),
+             follow_symlinks=False)
+
+
+def copy_range(src, dst, offset, length, methods):
+    """Copies length bytes at offset between two file descriptors, within
+    the kernel if it can and through a large buffer otherwise"""
+    end = offset + length
+    while offset < end:
+        count = min(COPY_CHUNK, end - offset)
+        if methods["copy_file_range"]:
+            try:
+                copied = os.copy_file_range(src, dst, count, offset, offset)
+            except OSError:
+                methods["copy_file_range"] = False
+                continue
+        else:
+            data = os.pread(src, count, offset)
+            copied = data and os.pwrite(dst, data, offset)
+        # The file shrank meanwhile
+        if not copied:
+            break
+        offset += copied
+
+
+def copy_sparse_data(src, dst, size, methods):
+    """Copies only the data of a sparse file between two file descriptors,
+    its holes stay holes. Filesystems that can't tell where the holes are
+    report the whole file as data."""
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(src, offset, os.SEEK_DATA)
+        except OSError:
+            # Nothing but a hole up to the end
+            break
+        end = os.lseek(src, start, os.SEEK_HOLE)
+        copy_range(src, dst, start, end - start, methods)
+        offset = end
+    os.ftruncate(dst, size)
+
+
+def copy_file_data(source, destination, status, methods):
+    """Copies the contents of a regular file, whose lstat is status:
+    sharing its extents where the filesystem can, within the kernel where
+    it can't and through a large buffer otherwise. Sparse files keep their
+    holes, a root filesystem can have files like /var/log/lastlog that
+    would otherwise take up far more than they do now. Returns the method
+    used."""
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        if methods["reflink"]:
+            try:
+                fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+                return "reflink"
+            except OSError:
+                methods["reflink"] = False
+        if status.st_blocks * 512 < status.st_size:
+            copy_sparse_data(src.fileno(), dst.fileno(), status.st_size,
+                             methods)
+            return "sparse"
+        if methods["copy_file_range"]:
+            try:
+                while os.copy_file_range(src.fileno(), dst.fileno(),
+                                         COPY_CHUNK):
+                    pass
+                return "copy_file_range"
+            except OSError:
+                methods["copy_file_range"] = False
+                src.seek(0)
+                dst.seek(0)
+                dst.truncate()
+        shutil.copyfileobj(src, dst, COPY_CHUNK)
+        return "buffered"
+
+
+def copy_file(source, destination, status, progress):
+    """Copies a regular file with its metadata, for copy_tree's workers"""
+    progress.add(status.st_size,
+                 copy_file_data(source, destination, status,
+                                progress.methods))
+    copy_metadata(source, destination, status)
+
+
+def plan_copy(source, destination):
+    """Walks source once, recreating its directories, symlinks, device
+    nodes, fifos and sockets under destination on the way. Like lxc-clone
+    it stays on one filesystem, mount points are left empty.
+
+    Returns (directories, files, links, bytes): the (source, destination,
+    lstat) of the directories and of the regular files still to be copied,
+    the (existing, new) names of hard links to make once they have been
+    and the size of the files."""
+    directories = [(source, destination, os.lstat(source))]
+    files = []
+    links = []
+    seen = {}
+    size = 0
+    device = directories[0][2].st_dev
+    os.mkdir(destination, 0o700)
+    pending = [(source, destination)]
+    while pending:
+        sourcedir, destdir = pending.pop()
+        with os.scandir(sourcedir) as items:
+            entries = list(items)
+        for item in entries:
+            status = item.stat(follow_symlinks=False)
+            path = os.path.join(destdir, item.name)
+            if stat.S_ISDIR(status.st_mode):
+                os.mkdir(path, 0o700)
+                directories.append((item.path, path, status))
+                if status.st_dev == device:
+                    pending.append((item.path, path))
+                continue
+            if status.st_nlink > 1:
+                inode = (status.st_dev, status.st_ino)
+                if inode in seen:
+                    links.append((seen[inode], path))
+                    continue
+                seen[inode] = path
+            if stat.S_ISREG(status.st_mode):
+                files.append((item.path, path, status))
+                size += status.st_size
+                continue
+            if stat.S_ISLNK(status.st_mode):
+                os.symlink(os.readlink(item.path), path)
+            else:
+                os.mknod(path, status.st_mode, status.st_rdev)
+            copy_metadata(item.path, path, status)
+    return directories, files, links, size
+
+
+def copy_tree(source, destination, workers=COPY_WORKERS):
+    """Copies a directory tree, usually a root filesystem, to destination,
+    which must not exist yet. Owners, modes, extended attributes, times,
+    hard links and special files are kept.
+
+    The tree is walked once, then its files are copied by a pool of
+    threads, largest first, see copy_file_data. Returns the CopyProgress."""
+    directories, files, links, size = plan_copy(source, destination)
+    progress = CopyProgress(size)
+    files.sort(key=lambda item: -item[2].st_size)
+    with concurrent.futures.ThreadPoolExecutor(workers) as pool:
+        pending = set(pool.submit(copy_file, src, dst, status, progress)
+                      for src, dst, status in files)
+        try:
+            while pending:
+                done, pending = concurrent.futures.wait(pending, timeout=1)
+                for future in done:
+                    future.result()
+                progress.report()
+        except BaseException:
+            for future in pending:
+                future.cancel()
+            raise
+    progress.report(end=True)
+    for existing, path in links:
+        os.link(existing, path, follow_symlinks=False)
+    # Deepest first, making entries in a directory changes its mtime
+    for src, dst, status in reversed(directories):
+        copy_metadata(src, dst, status)
+    return progress
+
+
+def special_files(directory, names):
+    """Ignores what shutil.copytree can't copy, for copybench"""
+    return [name for name in names
+            if not (os.path.islink(os.path.join(directory, name)) or
+                    os.path.isfile(os.path.join(directory, name)) or
+                    os.path.isdir(os.path.join(directory, name)))]
+
+
+def make_synthetic_tree(path, files, size):
+    """Fills path with something like a root filesystem for copybench:
+    mostly small files of size bytes on average, 50 to a directory, with
+    other owners, a setuid file, extended attributes, symlinks, hard links,
+    a sparse file, a fifo and a device node. Returns the bytes in the
+    files."""
+    data = os.urandom(size * 16)
+    total = 0
+    os.makedirs(path)
+    os.mkfifo(path + "/fifo")
+    os.mknod(path + "/null", stat.S_IFCHR | 0o666, os.makedev(1, 3))
+    # Mostly holes, like /var/log/lastlog
+    with open(path + "/sparse", "wb") as sparse:
+        sparse.seek(size * 64)
+        sparse.write(data[:4096])
+        sparse.truncate(size * 128)
+    total += size * 128
+    for number in range(files):
+        directory = "%s/%02d/%03d" % (path, number // 2500,
+                                      number // 50 % 50)
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        filename = "%s/file%s" % (directory, number)
+        length = min(int(random.expovariate(1 / size)), len(data))
+        with open(filename, "wb") as synthetic:
+            synthetic.write(data[:length])
+        total += length
+        if number % 10 == 1:
+            os.chown(filename, 1000 + number % 3, 1000)
+        if number % 50 == 2:
+            try:
+                os.setxattr(filename, "user.llxc", b"copybench")
+            except OSError:
+                pass
+        if number % 100 == 3:
+            os.symlink("file%s" % number, filename + ".link")
+        if number % 200 == 4:
+            os.link(filename, filename + ".hardlink")
+    if files:
+        os.chmod("%s/00/000/file0" % path, 0o4755)
+    return total
+
+
+def tree_signature(path):
+    """Lists what copy_tree keeps of the entries in a tree, to check a copy
+    against its source"""
+    signature = []
+    inodes = {}
+    for directory, subdirs, filenames in os.walk(path):
+        subdirs.sort()
+        for name in sorted(subdirs + filenames):
+            entry = os.path.join(directory, name)
+            status = os.lstat(entry)
+            if stat.S_ISDIR(status.st_mode):
+                details = ()
+            elif stat.S_ISLNK(status.st_mode):
+                details = (os.readlink(entry),)
+            else:
+                # Hard links are numbered in the order they are found in
+                details = (status.st_size, status.st_rdev, status.st_nlink,
+                           inodes.setdefault(status.st_ino, len(inodes)),
+                           status.st_blocks * 512 < status.st_size)
+            signature.append((os.path.relpath(entry, path), status.st_mode,
+                              status.st_uid, status.st_gid,
+                              status.st_mtime_ns,
+                              sorted(os.listxattr(entry,
+                                                  follow_symlinks=False)))
+                             + details)
+    return signature
+
+
+# Storage backends
+
+# Mount table and backends, read once per run
+MOUNTS = []
+STORAGE_BACKENDS = {}
+
+
+def mount_of(path):
+    """Returns (mount point, filesystem type, source) of the mount a path
+    is on"""
+    if not MOUNTS:
+        for line in open(MOUNTINFO_PATH):
+            fields = line.split()
+            mountpoint = fields[4].replace("\\040", " ")
+            separator = fields.index("-")
+            MOUNTS.append((mountpoint, fields[separator + 1],
+                           fields[separator + 2].replace("\\040", " ")))
+    path = os.path.realpath(path)
+    found = ("", None, None)
+    # Later mounts hide earlier ones on the same mount point
+    for mount in MOUNTS:
+        if ((path == mount[0] or
+             path.startswith(mount[0].rstrip("/") + "/")) and
+                len(mount[0]) >= len(found[0])):
+            found = mount
+    return found
+
+
+def filesystem_type(path):
+    """Returns the type of the filesystem a path is on"""
+    return mount_of(path)[1]
+
+
+def lvm_names(device):
+    """Returns (volume group, logical volume) of an LVM block device, or
+    None if it isn't one"""
+    try:
+        rdev = os.stat(device)
+        if not stat.S_ISBLK(rdev.st_mode):
+            return None
+        dmpath = "/sys/dev/block/%s:%s/dm/" % (os.major(rdev.st_rdev),
+                                               os.minor(rdev.st_rdev))
+        if not open(dmpath + "uuid").read().startswith("LVM-"):
+            return None
+        # Device mapper names are vg-lv, with dashes in either doubled
+        vg, lv = re.split(r"(?<!-)-(?!-)",
+                          open(dmpath + "name").read().strip())
+        return vg.replace("--", "-"), lv.replace("--", "-")
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def storage_backend(containername):
+    """Returns the storage backend of a container's root filesystem"""
+    if containername not in STORAGE_BACKENDS:
+        rootfs = (read_config_value(containername, "lxc.rootfs") or
+                  CONTAINER_PATH + containername + "/rootfs")
+        names = lvm_names(rootfs)
+        if names:
+            backend = LvmStorage(containername, rootfs, *names)
+        elif is_path_on_btrfs(rootfs):
+            backend = BtrfsStorage(containername, rootfs)
+        else:
+            backend = DirectoryStorage(containername, rootfs)
+        STORAGE_BACKENDS[containername] = backend
+    return STORAGE_BACKENDS[containername]
+
+
+class DirectoryStorage(object):
+    """Root filesystem in a plain directory. The other backends override
+    what their storage can do better."""
+
+    name = "directory"
+
+    def __init__(self, containername, rootfs):
+        self.containername = containername
+        self.rootfs = rootfs
+        self.snapshot_path = None
+        self.copy_progress = None
+
+    def usage(self):
+        """Returns (used, free) bytes"""
+        if not os.path.isdir(self.rootfs):
+            return 0, 0
+        stat = os.statvfs(self.rootfs)
+        return self.used(), stat.f_bavail * stat.f_frsize
+
+    def used(self):
+        """Walks the root filesystem, see walk_usage"""
+        cachefile = DU_CACHE_PATH + self.containername
+        try:
+            cache = json.load(open(cachefile))
+        except (IOError, ValueError):
+            cache = {}
+        used, cache = walk_usage(self.rootfs, cache)
+        os.makedirs(DU_CACHE_PATH, exist_ok=True)
+        # top's disk thread and other llxc processes may be walking too
+        descriptor, temporary = tempfile.mkstemp(
+            prefix="." + self.containername + ".", dir=DU_CACHE_PATH)
+        with os.fdopen(descriptor, "w") as cache_file:
+            json.dump(cache, cache_file)
+        os.rename(temporary, cachefile)
+        return used
+
+    def clone(self, newname):
+        """Creates the root filesystem of a new container as a clone of this
+        one, copy on write where the storage can. Returns its lxc.rootfs, or
+        None if that failed."""
+        newrootfs = CONTAINER_PATH + newname + "/rootfs"
+        if not os.path.isdir(self.rootfs) or os.path.exists(newrootfs):
+            return None
+        try:
+            self.copy_progress = copy_tree(self.rootfs, newrootfs)
+        except OSError as error:
+            print (_("   %serror:%s copying %s failed: %s"
+                     % (RED, NORMAL, self.rootfs, error)))
+            shutil.rmtree(newrootfs, ignore_errors=True)
+            return None
+        return newrootfs
+
+    def snapshot(self):
+        """Mounts a read-only point in time copy of the root filesystem.
+        Returns where, or None if the storage can't do that."""
+        return None
+
+    def release_snapshot(self):
+        """Removes the snapshot made by snapshot"""
+        self.snapshot_path = None
+
+    def mount(self):
+        """Returns a path the root filesystem can be read from"""
+        return self.rootfs
+
+    def umount(self, path):
+        """Undoes mount"""
+        pass
+
+    def destroy(self):
+        """Removes the root filesystem"""
+        if os.path.isdir(self.rootfs):
+            shutil.rmtree(self.rootfs)
+
+    def pool_usage(self):
+        """Describes the usage of the pool the storage comes from, if any"""
+        return None
+
+
+class BtrfsStorage(DirectoryStorage):
+    """Root filesystem in a btrfs subvolume"""
+
+    name = "btrfs"
+
+    def is_subvolume(self):
+        """Check whether the root filesystem is a subvolume of its own, the
+        root directory of a subvolume is always inode 256"""
+        try:
+            return os.lstat(self.rootfs).st_ino == 256
+        except OSError:
+            return False
+
+    def used(self):
+        # The qgroup of a plain directory is that of its parent subvolume
+        if self.is_subvolume():
+            used = btrfs_usage(self.rootfs)
+            if used is not None:
+                return used
+        return DirectoryStorage.used(self)
+
+    def btrfs(self, *arguments):
+        """Runs a btrfs subvolume command, returns True if it succeeded"""
+        return not subprocess.call(("btrfs", "subvolume") + arguments,
+                                   stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+
+    def clone(self, newname):
+        newrootfs = CONTAINER_PATH + newname + "/rootfs"
+        if self.btrfs("snapshot", self.rootfs, newrootfs):
+            return newrootfs
+        # Not a subvolume, copying still shares the extents
+        return DirectoryStorage.clone(self, newname)
+
+    def snapshot(self):
+        path = CONTAINER_PATH + "." + self.containername + ".snapshot"
+        if os.path.exists(path):
+            self.btrfs("delete", path)
+        if self.btrfs("snapshot", "-r", self.rootfs, path):
+            self.snapshot_path = path
+        return self.snapshot_path
+
+    def release_snapshot(self):
+        self.btrfs("delete", self.snapshot_path)
+        self.snapshot_path = None
+
+    def destroy(self):
+        # Not every rootfs on btrfs is a subvolume of its own
+        if not self.btrfs("delete", self.rootfs):
+            DirectoryStorage.destroy(self)
+
+
+class LvmStorage(DirectoryStorage):
+    """Root filesystem on an LVM logical volume, preferably a thin one.
+    Clones and snapshots of thin volumes are copy on write and allocate
+    nothing up front, those of other volumes reserve a share of the
+    origin's size."""
+
+    name = "lvm"
+
+    def __init__(self, containername, rootfs, vg, lv):
+        DirectoryStorage.__init__(self, containername, rootfs)
+        self.vg = vg
+        self.lv = lv
+        self.snapshot_lv = None
+        self.volumes = None
+
+    def lvm(self, *arguments):
+        """Runs an LVM command, returns True if it succeeded"""
+        return not subprocess.call(arguments, stdout=subprocess.DEVNULL,
+                                   stderr=subprocess.DEVNULL)
+
+    def read_volumes(self):
+        """Returns {name: (data percent, size, thin pool)} for all volumes
+        of the volume group, read once"""
+        if self.volumes is None:
+            self.volumes = {}
+            for line in os.popen("lvs --noheadings --nosuffix --units b "
+                                 "--separator '|' -o lv_name,data_percent,"
+                                 "lv_size,pool_lv " + self.vg +
+                                 " 2>/dev/null"):
+                fields = [field.strip() for field in line.split("|")]
+                if len(fields) == 4:
+                    self.volumes[fields[0]] = (
+                        float(fields[1].replace(",", ".") or 0),
+                        int(float(fields[2])), fields[3])
+        return self.volumes
+
+    def usage(self):
+        return lvm_usage(self.rootfs)
+
+    def create_snapshot(self, name, share):
+        """Creates and activates a snapshot of the volume, for volumes
+        that aren't thin with share percent of its size reserved"""
+        arguments = ["lvcreate", "-s", "-n", name]
+        if not self.read_volumes().get(self.lv, (0, 0, ""))[2]:
+            arguments += ["-l", "%s%%ORIGIN" % (share)]
+        # Thin snapshots are skipped when activating unless told otherwise
+        return (self.lvm(*(arguments + [self.vg + "/" + self.lv])) and
+                self.lvm("lvchange", "-ay", "-K", self.vg + "/" + name))
+
+    def clone(self, newname):
+        if self.create_snapshot(newname, 100):
+            return "/dev/%s/%s" % (self.vg, newname)
+        return None
+
+    def mount_volume(self, device, options):
+        """Mounts a volume on a new temporary directory, returns it or
+        None. Filesystems of snapshots share the origin's UUID, which XFS
+        refuses unless told to ignore it."""
+        path = tempfile.mkdtemp(prefix="llxc-")
+        for extra in ("", ",nouuid"):
+            if self.lvm("mount", "-o", options + extra, device, path):
+                return path
+        os.rmdir(path)
+        return None
+
+    def snapshot(self):
+        name = self.lv + "-llxcsnap"
+        if os.path.exists("/dev/%s/%s" % (self.vg, name)):
+            self.lvm("lvremove", "-f", self.vg + "/" + name)
+        if not self.create_snapshot(name, 20):
+            return None
+        self.snapshot_lv = name
+        self.snapshot_path = self.mount_volume("/dev/%s/%s"
+                                               % (self.vg, name), "ro")
+        if self.snapshot_path is None:
+            self.release_snapshot()
+        return self.snapshot_path
+
+    def release_snapshot(self):
+        if self.snapshot_path:
+            self.umount(self.snapshot_path)
+        self.lvm("lvremove", "-f", self.vg + "/" + self.snapshot_lv)
+        self.snapshot_lv = self.snapshot_path = None
+
+    def mount(self):
+        return self.mount_volume(self.rootfs, "rw")
+
+    def umount(self, path):
+        if path and self.lvm("umount", path):
+            os.rmdir(path)
+
+    def destroy(self):
+        self.lvm("lvremove", "-f", self.vg + "/" + self.lv)
+
+    def pool_usage(self):
+        pool = self.read_volumes().get(self.lv, (0, 0, ""))[2]
+        if not pool or pool not in self.volumes:
+            return None
+        percent, size = self.volumes[pool][:2]
+        return "%.1f%% of %.2f MiB in %s/%s" % (percent, size / 1000 / 1000,
+                                                self.vg, pool)
+
+
+def destroy_container(containername):
+    """Destroys a container with lxc, and the logical volume older
+    lxc-destroy leaves behind. Returns True if that succeeded."""
+    backend = storage_backend(containername)
+    if not lxc.Container(containername).destroy():
+        return False
+    if isinstance(backend, LvmStorage) and os.path.exists(backend.rootfs):
+        print (_("   removing logical volume %s..." % (backend.rootfs)))
+        backend.destroy()
+    return True
+
+
+def random_hwaddr():
+    """Returns a random MAC address in the range lxc uses"""
+    return "00:16:3e:%02x:%02x:%02x" % (random.randint(0, 255),
+                                        random.randint(0, 255),
+                                        random.randint(0, 255))
+
+
+def copy_container_config(origname, newname, rootfs):
+    """Copies the config files of a container to a new one, with its paths,
+    name, root filesystem and MAC addresses changed"""
+    origpath = CONTAINER_PATH + origname + "/"
+    newpath = CONTAINER_PATH + newname + "/"
+    for item in os.listdir(origpath):
+        if item != "rootfs" and os.path.isfile(origpath + item):
+            shutil.copy2(origpath + item, newpath + item)
+    if not os.path.isdir(newpath + "rootfs"):
+        os.mkdir(newpath + "rootfs")
+    config = open(newpath + "config").read().replace(origpath, newpath)
+    config = re.sub(r"(?m)^(\s*lxc\.network\.hwaddr\s*=).*$",
+                    lambda match: match.group(1) + " " + random_hwaddr(),
+                    config)
+    with open(newpath + "config", "w") as config_file:
+        config_file.write(config)
+    set_config_value(newname, "lxc.utsname", newname)
+    set_config_value(newname, "lxc.rootfs", rootfs)
+
+
+def clone_container(origname, newname):
+    """Clones a container with a clone of its storage, see
+    DirectoryStorage.clone.
+
+    The config is copied with the paths, name and MAC addresses changed.
+    Returns False, leaving nothing behind, if the storage can't do that,
+    the CopyProgress if the files were copied and True for snapshots."""
+    newpath = CONTAINER_PATH + newname + "/"
+    os.makedirs(newpath)
+    origin = storage_backend(origname)
+    rootfs = origin.clone(newname)
+    if rootfs is None:
+        os.rmdir(newpath)
+        return False
+    copy_container_config(origname, newname, rootfs)
+    backend = storage_backend(newname)
+    path = backend.mount()
+    if path:
+        try:
+            with open(path + "/etc/hostname", "w") as hostname:
+                hostname.write(newname + "\n")
+        except IOError:
+            pass
+        backend.umount(path)
+    return origin.copy_progress or True
+
+
+def is_ephemeral(containername):
+    """Check whether a container was made by 'llxc ephemeral'"""
+    return os.path.exists(CONTAINER_PATH + containername + "/ephemeral")
+
+
+def create_ephemeral(base, containername):
+    """Creates a container whose root filesystem is an overlay: changes go
+    to delta/upper in its own directory, everything else is read from the
+    base's root filesystem. Creating and removing it takes the same time
+    however big the base is. Returns False if the overlay can't be
+    mounted."""
+    path = CONTAINER_PATH + containername + "/"
+    for directory in ("delta/upper", "delta/work", "rootfs"):
+        os.makedirs(path + directory)
+    copy_container_config(base, containername, path + "rootfs")
+    # Static addresses would clash with the base, use DHCP instead
+    config = [line for line in open(path + "config")
+              if line.partition("=")[0].strip() != "lxc.network.ipv4"]
+    with open(path + "config", "w") as config_file:
+        config_file.writelines(config)
+    if subprocess.call(["mount", "-t", "overlay", "overlay", "-o",
+                        "lowerdir=%s,upperdir=%s,workdir=%s"
+                        % (storage_backend(base).rootfs, path + "delta/upper",
+                           path + "delta/work"), path + "rootfs"]):
+        shutil.rmtree(path)
+        return False
+    with open(path + "ephemeral", "w") as marker:
+        marker.write(base + "\n")
+    try:
+        with open(path + "rootfs/etc/hostname", "w") as hostname:
+            hostname.write(containername + "\n")
+    except IOError:
+        pass
+    update_index(containername)
+    return True
+
+
+def ephemerals_on(base):
+    """Returns the ephemeral containers whose overlays use a base"""
+    users = []
+    for containername in list_containers():
+        try:
+            marker = open(CONTAINER_PATH + containername + "/ephemeral")
+        except IOError:
+            continue
+        with marker:
+            if marker.read().strip() == base:
+                users.append(containername)
+    return users
+
+
+def remove_ephemeral(containername):
+    """Unmounts the overlay of an ephemeral container and removes it with
+    all of its changes"""
+    path = CONTAINER_PATH + containername + "/"
+    subprocess.call(["umount", path + "rootfs"], stderr=subprocess.DEVNULL)
+    # Removing through a mounted overlay would walk the whole base
+    if os.path.ismount(path + "rootfs"):
+        print (_("   %serror:%s could not unmount %srootfs, not removed"
+                 % (RED, NORMAL, path)))
+        return
+    shutil.rmtree(path)
+    update_index(containername)
+
+
+def remove_if_ephemeral(containername):
+    """Removes an ephemeral container once it has stopped"""
+    if is_ephemeral(containername) and not is_container_active(containername):
+        print (_(" * Removing ephemeral container %s..." % (containername)))
+        remove_ephemeral(containername)
+
+
+def use_unpacked_rootfs(containername):
+    """Points the config of a container unpacked from a tarball at the
+    unpacked root filesystem. Those of LVM backed containers still name
+    their logical volume, which may be gone or hold older data."""
+    rootfs = read_config_value(containername, "lxc.rootfs")
+    if rootfs and rootfs.startswith("/dev/"):
+        set_config_value(containername, "lxc.rootfs",
+                         CONTAINER_PATH + containername + "/rootfs")
+
+
+def add_container_to_tar(tar, containername, rootfs):
+    """Adds a container's directory to a tarball, with its root filesystem
+    read from rootfs, which may be a snapshot or mounted volume"""
+
+    def skip_rootfs(tarinfo):
+        """Leaves the rootfs out, it's added from rootfs instead"""
+        if tarinfo.name == containername + "/rootfs":
+            return None
+        return tarinfo
+
+    tar.add(CONTAINER_PATH + containername, arcname=containername,
+            filter=skip_rootfs)
+    tar.add(rootfs, arcname=containername + "/rootfs")
+
+
+# I/O isolation
+
+def parse_size(size, unit=1000):
+    """Converts sizes like 500K, 20M or 1G to a number. Rates are counted
+    in units of 1000, memory is counted in 1024 like cgroups do."""
+    multipliers = {"K": unit, "M": unit ** 2, "G": unit ** 3, "T": unit ** 4}
+    size = str(size).strip().upper()
+    if size[-1:] in multipliers:
+        return int(float(size[:-1]) * multipliers[size[-1]])
+    return int(size)
+
+
+def block_device_of(path):
+    """Returns 'major:minor' of the disk a path is stored on, or None if
+    there's no such disk. Partitions are resolved to their disk, the blkio
+    throttles don't accept them.
+
+    btrfs reports an anonymous device for every filesystem, the device it
+    is mounted from is used instead. For filesystems spanning several
+    devices that is only the first one."""
+    device = os.stat(path).st_dev
+    if not os.path.exists("/sys/dev/block/%s:%s"
+                          % (os.major(device), os.minor(device))):
+        try:
+            source = os.stat(mount_of(path)[2])
+        except (OSError, TypeError):
+            return None
+        if not stat.S_ISBLK(source.st_mode):
+            return None
+        device = source.st_rdev
+    sysfs = os.path.realpath("/sys/dev/block/%s:%s"
+                             % (os.major(device), os.minor(device)))
+    if os.path.exists(sysfs + "/partition"):
+        return open(os.path.dirname(sysfs) + "/dev").read().strip()
+    return "%s:%s" % (os.major(device), os.minor(device))
+
+
+def read_io_policy(command):
+    """Returns the I/O policy of a command from IOPOLICY_PATH, options
+    given on the command line take precedence.
+
+    IOPOLICY_PATH has a section per command, eg. [archive], and a
+    [DEFAULT] section for everything else."""
+    config = configparser.ConfigParser(defaults=IOPOLICY_DEFAULTS)
+    config.read(IOPOLICY_PATH)
+    if config.has_section(command):
+        policy = dict(config.items(command))
+    else:
+        policy = dict(config.defaults())
+    overrides = {"weight": "io_weight", "bps": "io_bps", "iops": "io_iops",
+                 "cpushares": "cpu_shares", "ionice": "ionice",
+                 "nice": "nice"}
+    for key, option in overrides.items():
+        if getattr(ARGS, option, None) is not None:
+            policy[key] = str(getattr(ARGS, option))
+    return policy
+
+
+def enter_io_policy(command):
+    """Moves llxc in to cgroups limiting its disk and cpu use according to
+    the I/O policy of a command, and lowers its ionice class and nice
+    level. Returns what is needed to undo that, to be passed to
+    leave_io_policy.
+
+    Everything llxc starts meanwhile inherits the policy, so containers
+    must only be started again after leaving it."""
+    policy = read_io_policy(command)
+    settings = {"blkio": [], "cpu": []}
+    if policy["weight"]:
+        settings["blkio"].append(("blkio.weight", policy["weight"]))
+    for limit, key in (("bps", "bps_device"), ("iops", "iops_device")):
+        if policy[limit]:
+            device = block_device_of(CONTAINER_PATH)
+            if not device:
+                print (_("   %swarning:%s no disk found for %s, the %s "
+                         "limit doesn't apply"
+                         % (YELLOW, NORMAL, CONTAINER_PATH, limit)))
+                continue
+            for direction in ("read", "write"):
+                settings["blkio"].append(
+                    ("blkio.throttle.%s_%s" % (direction, key),
+                     "%s %s" % (device, parse_size(policy[limit]))))
+    if policy["cpushares"]:
+        settings["cpu"].append(("cpu.shares", policy["cpushares"]))
+    cgroups = []
+    for controller in sorted(settings):
+        if not settings[controller]:
+            continue
+        cgroup = (CGROUP_PATH + controller + "/llxc-%s-%s/"
+                  % (command, os.getpid()))
+        try:
+            os.mkdir(cgroup)
+            cgroups.append(cgroup)
+            for key, value in settings[controller]:
+                with open(cgroup + key, "w") as cgroup_file:
+                    cgroup_file.write(value)
+            with open(cgroup + "cgroup.procs", "w") as cgroup_file:
+                cgroup_file.write(str(os.getpid()))
+        except OSError as error:
+            print (_("   %swarning:%s could not set up %s cgroup: %s"
+                     % (YELLOW, NORMAL, controller, error)))
+    previous = {"cgroups": cgroups, "ionice": None,
+                "nice": os.getpriority(os.PRIO_PROCESS, 0)}
+    if policy["ionice"] in IONICE_CLASSES:
+        previous["ionice"] = read_ionice()
+        subprocess.call(["ionice", "-c", IONICE_CLASSES[policy["ionice"]],
+                         "-p", str(os.getpid())],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    if int(policy["nice"] or 0):
+        os.nice(int(policy["nice"]))
+    return previous
+
+
+def read_ionice():
+    """Returns the ionice arguments setting llxc's current class and
+    priority again"""
+    try:
+        output = subprocess.check_output(["ionice", "-p", str(os.getpid())],
+                                         stderr=subprocess.DEVNULL)
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    ioclass, _separator, priority = output.decode().partition(": prio ")
+    classes = {"none": "0", "realtime": "1", "best-effort": "2", "idle": "3"}
+    if ioclass.strip() not in classes:
+        return None
+    arguments = ["-c", classes[ioclass.strip()]]
+    if priority.strip() and arguments[1] in ("1", "2"):
+        arguments += ["-n", priority.strip()]
+    return arguments
+
+
+def leave_io_policy(previous):
+    """Moves llxc back to the root cgroups, removes those created by
+    enter_io_policy and restores the ionice class and nice level"""
+    if previous["ionice"]:
+        subprocess.call(["ionice"] + previous["ionice"] +
+                        ["-p", str(os.getpid())],
+                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    os.setpriority(os.PRIO_PROCESS, 0, previous["nice"])
+    for cgroup in previous["cgroups"]:
+        try:
+            with open(os.path.dirname(cgroup.rstrip("/")) + "/cgroup.procs",
+                      "w") as cgroup_file:
+                cgroup_file.write(str(os.getpid()))
+            os.rmdir(cgroup)
+        except OSError:
+            pass
+
+
+def report_throughput(size, started):
+    """Prints how fast size bytes were processed since started"""
+    duration = max(time.time() - started, 0.001)
+    print (_("   %sinfo:%s %.2f MiB in %.1f seconds, %.2f MiB/s"
+             % (CYAN, NORMAL, size / 1000 / 1000, duration,
+                size / 1000 / 1000 / duration)))
+
+
+def add_io_arguments(subparser):
+    """Adds the options overriding the I/O policy to a sub command"""
+    subparser.add_argument('--io-weight', type=int,
+                           help="blkio weight, 10 to 1000")
+    subparser.add_argument('--io-bps', type=str,
+                           help="Read and write limit each, eg. 50M")
+    subparser.add_argument('--io-iops', type=str,
+                           help="Read and write operations per second each")
+    subparser.add_argument('--cpu-shares', type=int,
+                           help="cpu shares, the default for others is 1024")
+    subparser.add_argument('--ionice', type=str,
+                           choices=sorted(IONICE_CLASSES) + ['none'],
+                           help="ionice scheduling class")
+    subparser.add_argument('--nice', type=int, help="nice level")
+
+
+# Backup and restore
+
+class RateLimiter(object):
+    """Limits the combined throughput of everyone sharing it to a number of
+    bytes per second, 0 means unlimited"""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.next_slot = time.time()
+
+    def consume(self, amount):
+        """Waits until amount bytes may be transferred"""
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.time()
+            self.next_slot = max(self.next_slot, now) + amount / self.rate
+            delay = self.next_slot - now
+        time.sleep(delay)
+
+
+class ThrottledFile(object):
+    """Wraps a file object so that reads and writes pass a RateLimiter"""
+
+    def __init__(self, fileobj, limiter):
+        self.fileobj = fileobj
+        self.limiter = limiter
+
+    def read(self, size=-1):
+        data = self.fileobj.read(size)
+        self.limiter.consume(len(data))
+        return data
+
+    def write(self, data):
+        self.limiter.consume(len(data))
+        return self.fileobj.write(data)
+
+
+def read_manifest(path):
+    """Reads the manifest of a backup directory"""
+    try:
+        return json.load(open(path + "manifest"))
+    except (IOError, ValueError):
+        return {"containers": {}}
+
+
+def write_manifest(path, manifest):
+    """Replaces the manifest of a backup directory atomically"""
+    with open(path + "manifest.tmp", "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.rename(path + "manifest.tmp", path + "manifest")
+
+
+def backup_container(containername, tarball, limiter, halted, online=False):
+    """Writes a container to a tarball, returns the size of the tarball.
+
+    Running containers are halted and added to halted, for the caller to
+    start again once it has left its I/O policy. Online
+    backups read from a snapshot of the root filesystem instead, or keep
+    the container frozen while it is read if the storage can't snapshot."""
+    cont = lxc.Container(containername)
+    backend = storage_backend(containername)
+    was_running = cont.state == "RUNNING"
+    frozen = False
+    rootfs = None
+    if online:
+        rootfs = backend.snapshot()
+    if was_running and rootfs is None:
+        # Logical volumes can't be mounted a second time while in use
+        if online and not isinstance(backend, LvmStorage):
+            frozen = cont.freeze()
+        elif cont.shutdown():
+            halted.append(containername)
+    if rootfs is None:
+        rootfs = backend.mount()
+
+    try:
+        with open(tarball + ".partial", "wb") as tarball_file:
+            compressed = gzip.GzipFile(fileobj=tarball_file, mode="wb")
+            tar = tarfile.open(fileobj=ThrottledFile(compressed, limiter),
+                               mode="w|")
+            add_container_to_tar(tar, containername, rootfs)
+            tar.close()
+            compressed.close()
+        os.rename(tarball + ".partial", tarball)
+    finally:
+        if backend.snapshot_path:
+            backend.release_snapshot()
+        else:
+            backend.umount(rootfs)
+        if frozen:
+            cont.unfreeze()
+    return os.path.getsize(tarball)
+
+
+def restore_container(containername, tarball, limiter):
+    """Extracts a container from a tarball written by backup_container.
+
+    It is extracted next to CONTAINER_PATH first and only moved in place
+    once complete, so an interrupted restore leaves nothing behind."""
+    staging = CONTAINER_PATH + "." + containername + ".restore/"
+    if os.path.exists(staging):
+        if is_path_on_btrfs(staging + containername + "/rootfs"):
+            subprocess.call(["btrfs", "subvolume", "delete",
+                             staging + containername + "/rootfs"],
+                            stdout=subprocess.DEVNULL)
+        shutil.rmtree(staging)
+    os.makedirs(staging + containername)
+    if is_path_on_btrfs(CONTAINER_PATH):
+        subprocess.call(["btrfs", "subvolume", "create",
+                         staging + containername + "/rootfs"],
+                        stdout=subprocess.DEVNULL)
+    with open(tarball, "rb") as tarball_file:
+        tar = tarfile.open(fileobj=ThrottledFile(
+            gzip.GzipFile(fileobj=tarball_file, mode="rb"), limiter),
+            mode="r|")
+        tar.extractall(staging)
+        tar.close()
+    os.rename(staging + containername, CONTAINER_PATH + containername)
+    os.rmdir(staging)
+    use_unpacked_rootfs(containername)
+
+
+# Desired state
+
+def read_manifest_file(path):
+    """Reads a manifest of desired container states, one section per
+    container:
+
+        [web01]
+        state = running       (running, stopped, frozen or absent)
+        autostart = yes
+        template = ubuntu
+        memory = 512M         (memory limit)
+        cpuclass = dedicated  (cpu placement, see 'llxc cpuclass')
+        weight = 2
+        depends = db01
+
+    A [DEFAULT] section applies to all containers."""
+    config = configparser.ConfigParser()
+    if not config.read(path):
+        print (_("   %serror 404:%s The manifest %s could not be read."
+                 % (RED, NORMAL, path)))
+        sys.exit(404)
+    manifest = {}
+    try:
+        for containername in config.sections():
+            section = config[containername]
+            entry = {"state": section.get("state", "running"),
+                     "autostart": section.getboolean("autostart", None),
+                     "template": section.get("template", "ubuntu"),
+                     "memory": section.get("memory"),
+                     "cpuclass": section.get("cpuclass"),
+                     "weight": section.getint("weight", 1),
+                     "depends": section.get("depends", "").split()}
+            if entry["state"] not in ("running", "stopped", "frozen",
+                                      "absent"):
+                raise ValueError("state of %s is %s"
+                                 % (containername, entry["state"]))
+            if entry["cpuclass"] not in (None, "dedicated", "shared"):
+                raise ValueError("cpuclass of %s is %s"
+                                 % (containername, entry["cpuclass"]))
+            if entry["memory"]:
+                entry["memory"] = parse_size(entry["memory"], 1024)
+            manifest[containername] = entry
+    except ValueError as error:
+        print (_("   %serror:%s Invalid manifest: %s" % (RED, NORMAL, error)))
+        sys.exit(1)
+    for containername, entry in manifest.items():
+        for dependency in entry["depends"]:
+            if dependency not in manifest:
+                print (_("   %serror:%s %s depends on %s, which is not in "
+                         "the manifest" % (RED, NORMAL, containername,
+                                           dependency)))
+                sys.exit(1)
+    return manifest
+
+
+def dependency_levels(manifest):
+    """Sorts the containers of a manifest in to levels, each depending
+    only on containers in earlier levels"""
+    levels = []
+    placed = set()
+    while len(placed) < len(manifest):
+        level = sorted(containername for containername in manifest
+                       if containername not in placed and
+                       set(manifest[containername]["depends"]) <= placed)
+        if not level:
+            print (_("   %serror:%s Circular dependency between: %s"
+                     % (RED, NORMAL,
+                        " ".join(sorted(set(manifest) - placed)))))
+            sys.exit(1)
+        levels.append(level)
+        placed.update(level)
+    return levels
+
+
+def plan_changes(manifest):
+    """Compares a manifest to the containers on the host.
+
+    Returns {name: (actions going down, actions going up)} for containers
+    that need changes, an action is a tuple of a verb and its arguments."""
+    existing = set(list_containers())
+    plan = {}
+    for containername, entry in manifest.items():
+        down = []
+        up = []
+        desired = entry["state"]
+        if containername in existing:
+            state = container_state(containername)
+        else:
+            state = "ABSENT"
+        if desired == "absent":
+            if state != "ABSENT":
+                down.append(("destroy",))
+        else:
+            if state == "ABSENT":
+                up.append(("create", entry["template"]))
+                state = "STOPPED"
+            if state == "FROZEN" and desired != "frozen":
+                down.append(("unfreeze",))
+                state = "RUNNING"
+            if state == "RUNNING" and desired == "stopped":
+                down.append(("halt",))
+            if (entry["memory"] and
+                    parse_size(read_config_value(
+                        containername,
+                        "lxc.cgroup.memory.limit_in_bytes") or 0, 1024) !=
+                    entry["memory"]):
+                up.append(("memory", entry["memory"]))
+            if (entry["cpuclass"] and read_placement(containername) !=
+                    (entry["cpuclass"], entry["weight"])):
+                up.append(("cpuclass", entry["cpuclass"], entry["weight"]))
+            if (entry["autostart"] is not None and entry["autostart"] !=
+                    os.path.lexists(AUTOSTART_PATH + containername)):
+                up.append(("autostart", entry["autostart"]))
+            if state == "STOPPED" and desired in ("running", "frozen"):
+                up.append(("start",))
+                state = "RUNNING"
+            if state == "RUNNING" and desired == "frozen":
+                up.append(("freeze",))
+        if down or up:
+            plan[containername] = (down, up)
+    return plan
+
+
+# Serialises cpu placement, which touches the configs of all containers
+PLACEMENT_LOCK = threading.Lock()
+
+
+def perform_actions(containername, actions):
+    """Carries out planned actions on a container, stops at the first one
+    that fails. Returns True if all succeeded."""
+    cont = lxc.Container(containername)
+    for action in actions:
+        verb = action[0]
+        if verb == "create":
+            done = cont.create(action[1])
+        elif (verb in ("start", "destroy") and
+              ephemerals_on(containername)):
+            print (_("   %serror:%s %s is the base of ephemeral containers"
+                     % (RED, NORMAL, containername)))
+            done = False
+        elif verb == "destroy":
+            if is_container_active(containername):
+                cont.stop()
+            done = destroy_container(containername)
+            if done and os.path.lexists(AUTOSTART_PATH + containername):
+                os.remove(AUTOSTART_PATH + containername)
+        elif verb == "start":
+            with PLACEMENT_LOCK:
+                place_containers([containername])
+            done = cont.start()
+        elif verb == "halt":
+            done = cont.shutdown()
+        elif verb == "freeze":
+            done = cont.freeze()
+        elif verb == "unfreeze":
+            if os.path.exists(IDLE_PATH + "frozen/" + containername):
+                os.remove(IDLE_PATH + "frozen/" + containername)
+            done = cont.unfreeze()
+        elif verb == "memory":
+            set_config_value(containername,
+                             "lxc.cgroup.memory.limit_in_bytes", action[1])
+            if is_container_active(containername):
+                with open(CGROUP_PATH + "memory/lxc/" + containername +
+                          "/memory.limit_in_bytes", "w") as cgroup_file:
+                    cgroup_file.write(str(action[1]))
+            done = True
+        elif verb == "cpuclass":
+            if not os.path.exists(PLACEMENT_PATH):
+                os.makedirs(PLACEMENT_PATH)
+            with open(PLACEMENT_PATH + containername, "w") as placement:
+                placement.write("%s %s\n" % (action[1], action[2]))
+            # Re-pinned right away, as memory limits are changed live
+            if is_container_active(containername):
+                with PLACEMENT_LOCK:
+                    place_containers([])
+            done = True
+        elif verb == "autostart":
+            if action[1]:
+                os.symlink(CONTAINER_PATH + containername,
+                           AUTOSTART_PATH + containername)
+            else:
+                os.unlink(AUTOSTART_PATH + containername)
+            done = True
+        if not done:
+            print (_("   %serror:%s %s: %s failed"
+                     % (RED, NORMAL, containername, verb)))
+            return False
+        print (_("   %s%s:%s %s done" % (GREEN, containername, NORMAL, verb)))
+    return True
+
+
+# Dashboard
+
+def config_hwaddr(containername):
+    """Returns the MAC address of a container's first interface from its
+    config file"""
+    try:
+        for line in open(CONTAINER_PATH + containername + "/config"):
+            key, _sep, value = line.partition("=")
+            if key.strip() == "lxc.network.hwaddr":
+                return value.strip().lower()
+    except IOError:
+        pass
+    return None
+
+
+def sample_row(containername, row, now):
+    """Refreshes the cheap, cgroup based counters of a dashboard row"""
+    cgroup = "lxc/" + containername + "/"
+    state = container_state(containername)
+    try:
+        tasks = len(open(CGROUP_PATH + "cpuset/" + cgroup +
+                         "tasks").read().split())
+    except IOError:
+        tasks = 0
+    try:
+        memory = int(open(CGROUP_PATH + "memory/" + cgroup +
+                          "memory.usage_in_bytes").read())
+    except (IOError, ValueError):
+        memory = 0
+    try:
+        cputime = int(open(CGROUP_PATH + "cpuacct/" + cgroup +
+                           "cpuacct.usage").read())
+    except (IOError, ValueError):
+        cputime = None
+    if (cputime is not None and row.get("cputime") is not None and
+            now > row["sampled"]):
+        row["cpu"] = ((cputime - row["cputime"]) / 1000000000.0 /
+                      (now - row["sampled"]) * 100)
+    else:
+        row["cpu"] = 0.0
+    if state != row.get("state"):
+        # Addresses change with the state, look them up again
+        row["ip_checked"] = 0
+    row.update(state=state, tasks=tasks, memory=memory, cputime=cputime,
+               sampled=now)
+    if state == "STOPPED":
+        row["ip"] = "-"
+    elif now - row["ip_checked"] >= TOP_SLOW_INTERVAL:
+        addresses = host_addresses().get(row["hwaddr"], {}).get("ipv4")
+        row["ip"] = addresses[0] if addresses else "-"
+        row["ip_checked"] = now
+
+
+def format_row(row):
+    """Returns the cells of a dashboard row, in TOP_COLUMNS order"""
+    if row["disk"] is None:
+        disk = "..."
+    else:
+        disk = "%.1f MiB" % (row["disk"] / 1000 / 1000)
+    return [row["name"], row["state"].lower(), str(row["tasks"]),
+            "%.1f MiB" % (row["memory"] / 1000 / 1000), "%.1f" % (row["cpu"]),
+            row["ip"], disk]
+
+
+def draw_cell(stdscr, screen, y, x, width, text, attribute=0):
+    """Writes a cell unless the screen already shows exactly that.
+
+    screen maps (y, x) to what was last written there."""
+    maxy, maxx = stdscr.getmaxyx()
+    width = min(width, maxx - x - 1)
+    if y >= maxy or width <= 0:
+        return
+    cell = (text[:width].ljust(width), attribute)
+    if screen.get((y, x)) != cell:
+        try:
+            stdscr.addstr(y, x, cell[0], attribute)
+        except curses.error:
+            pass
+        screen[(y, x)] = cell
+
+
+def measure_disks(rows):
+    """Keeps walking container filesystems for 'top' in the background"""
+    while True:
+        for row in list(rows.values()):
+            if time.time() - row["disk_checked"] >= TOP_DISK_INTERVAL:
+                try:
+                    row["disk"] = disk_usage(row["name"])[0]
+                except (OSError, IOError):
+                    pass
+                row["disk_checked"] = time.time()
+        time.sleep(1)
+
+
+def top_action(action, containername, view):
+    """Runs a key binding of 'top' on a container, in a thread of its own
+    so that the dashboard keeps updating"""
+    cont = lxc.Container(containername)
+    try:
+        if action == "start":
+            done = not ephemerals_on(containername)
+            if done:
+                place_containers([containername])
+                done = cont.start()
+        elif action == "halt":
+            done = cont.shutdown()
+            if done and is_ephemeral(containername):
+                remove_ephemeral(containername)
+        elif action == "freeze":
+            done = cont.freeze()
+        else:
+            if os.path.exists(IDLE_PATH + "frozen/" + containername):
+                os.remove(IDLE_PATH + "frozen/" + containername)
+            done = cont.unfreeze()
+        update_index(containername)
+    except (OSError, IOError):
+        done = False
+    if done:
+        view["message"] = _("%s: %s succeeded") % (containername, action)
+    else:
+        view["message"] = _("%s: %s failed") % (containername, action)
+
+
+def run_top(stdscr):
+    """Main loop of 'top'. Counters are sampled every interval, the
+    container list and addresses every TOP_SLOW_INTERVAL and disk usage in
+    the background, and only cells that changed are redrawn."""
+    try:
+        curses.curs_set(0)
+    except curses.error:
+        pass
+    stdscr.timeout(100)
+    rows = {}
+    screen = {}
+    sort_keys = [key for key, title, width in TOP_COLUMNS if key != "ip"]
+    view = {"sort": "cpu", "filter": "", "selected": 0, "offset": 0,
+            "message": _("q:quit  o:sort  /:filter  s:start  h:halt  "
+                         "f:freeze  u:unfreeze")}
+    threading.Thread(target=measure_disks, args=(rows,), daemon=True).start()
+    last_sample = last_inventory = 0
+    while True:
+        now = time.time()
+        if now - last_inventory >= TOP_SLOW_INTERVAL:
+            names = list_containers()
+            for containername in set(rows) - set(names):
+                del rows[containername]
+            for containername in names:
+                if containername not in rows:
+                    rows[containername] = {
+                        "name": containername, "ip": "-", "ip_checked": 0,
+                        "disk": None, "disk_checked": 0,
+                        "hwaddr": config_hwaddr(containername)}
+                    # New rows can't wait for the next sample to be shown
+                    sample_row(containername, rows[containername], now)
+            last_inventory = now
+        if now - last_sample >= ARGS.interval:
+            for containername in list(rows):
+                sample_row(containername, rows[containername], now)
+            last_sample = now
+
+        shown = [row for row in rows.values() if view["filter"] in row["name"]]
+        if view["sort"] in ("name", "state"):
+            shown.sort(key=lambda row: (row[view["sort"]], row["name"]))
+        else:
+            shown.sort(key=lambda row: (-(row[view["sort"]] or 0),
+                                        row["name"]))
+        maxy, maxx = stdscr.getmaxyx()
+        visible = max(maxy - 3, 1)
+        view["selected"] = max(0, min(view["selected"], len(shown) - 1))
+        if view["selected"] < view["offset"]:
+            view["offset"] = view["selected"]
+        elif view["selected"] >= view["offset"] + visible:
+            view["offset"] = view["selected"] - visible + 1
+
+        draw_cell(stdscr, screen, 0, 0, maxx,
+                  _("llxc top - %s containers, sorted by %s%s")
+                  % (len(shown), view["sort"],
+                     view["filter"] and _(", matching '%s'")
+                     % (view["filter"]) or ""), curses.A_BOLD)
+        x = 0
+        for key, title, width in TOP_COLUMNS:
+            if key == view["sort"]:
+                title = title + "*"
+            draw_cell(stdscr, screen, 1, x, width, title, curses.A_REVERSE)
+            x += width
+        for line in range(visible):
+            index = view["offset"] + line
+            if index < len(shown):
+                cells = format_row(shown[index])
+            else:
+                cells = [""] * len(TOP_COLUMNS)
+            if index == view["selected"] and index < len(shown):
+                attribute = curses.A_STANDOUT
+            else:
+                attribute = 0
+            x = 0
+            for (key, title, width), cell in zip(TOP_COLUMNS, cells):
+                draw_cell(stdscr, screen, line + 2, x, width, cell, attribute)
+                x += width
+        draw_cell(stdscr, screen, maxy - 1, 0, maxx, view["message"])
+        stdscr.refresh()
+
+        key = stdscr.getch()
+        if key == -1:
+            continue
+        elif key == ord("q"):
+            break
+        elif key == curses.KEY_RESIZE:
+            screen.clear()
+            stdscr.clear()
+        elif key in (curses.KEY_UP, ord("k")):
+            view["selected"] -= 1
+        elif key in (curses.KEY_DOWN, ord("j")):
+            view["selected"] += 1
+        elif key == ord("o"):
+            view["sort"] = sort_keys[(sort_keys.index(view["sort"]) + 1) %
+                                     len(sort_keys)]
+        elif key == ord("/"):
+            prompt = _("filter: ")
+            draw_cell(stdscr, screen, maxy - 1, 0, maxx, prompt)
+            curses.echo()
+            stdscr.timeout(-1)
+            view["filter"] = stdscr.getstr(maxy - 1, len(prompt),
+                                           40).decode().strip()
+            stdscr.timeout(100)
+            curses.noecho()
+            screen.pop((maxy - 1, 0), None)
+            view["selected"] = 0
+        elif shown and key in (ord("s"), ord("h"), ord("f"), ord("u")):
+            action = {ord("s"): "start", ord("h"): "halt",
+                      ord("f"): "freeze", ord("u"): "unfreeze"}[key]
+            containername = shown[view["selected"]]["name"]
+            view["message"] = _("%s: %s...") % (containername, action)
+            threading.Thread(target=top_action,
+                             args=(action, containername, view),
+                             daemon=True).start()
+
+
+# Network addresses
+
+# Addresses of MAC addresses seen on the host, see host_addresses
+ADDRESS_CACHE = {"addresses": {}, "expires": 0, "leases": None}
+
+
+def read_leases():
+    """Returns {mac: [(ipv4 address, expiry)]} from the dnsmasq lease files
+    of lxc-net. An expiry of 0 means the lease never expires."""
+    leases = {}
+    for leasefile in glob.glob(LEASES_PATH):
+        try:
+            for line in open(leasefile):
+                fields = line.split()
+                # IPv6 leases are keyed by DUID and IAID, not by MAC
+                if len(fields) < 3 or fields[1].count(":") != 5:
+                    continue
+                leases.setdefault(fields[1].lower(), []).append(
+                    (fields[2], int(fields[0])))
+        except (IOError, ValueError):
+            pass
+    return leases
+
+
+def read_neighbours():
+    """Returns [(mac, address)] from the kernel's neighbour tables, asked
+    over netlink, or read from /proc/net/arp (IPv4 only) without it"""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW,
+                             socket.NETLINK_ROUTE)
+    except (AttributeError, OSError):
+        neighbours = []
+        for line in open("/proc/net/arp").readlines()[1:]:
+            fields = line.split()
+            if len(fields) >= 4 and fields[3] != "00:00:00:00:00:00":
+                neighbours.append((fields[3].lower(), fields[0]))
+        return neighbours
+    # RTM_GETNEIGH with NLM_F_REQUEST | NLM_F_DUMP for all families
+    sock.send(struct.pack("=IHHIIBBHiHBB", 28, 30, 0x301, 1, 0,
+                          socket.AF_UNSPEC, 0, 0, 0, 0, 0, 0))
+    neighbours = []
+    done = False
+    while not done:
+        data = sock.recv(65536)
+        offset = 0
+        while offset + 16 <= len(data):
+            length, msgtype = struct.unpack_from("=IH", data, offset)
+            if length < 16 or msgtype in (2, 3):
+                # NLMSG_ERROR or NLMSG_DONE
+                done = True
+                break
+            family, state = struct.unpack_from("=B7xH", data, offset + 16)
+            # Skip NUD_INCOMPLETE, NUD_FAILED and NUD_NOARP entries
+            if msgtype == 28 and not state & 0x61:
+                attributes = {}
+                position = offset + 28
+                while position + 4 <= offset + length:
+                    attrlength, attrtype = struct.unpack_from("=HH", data,
+                                                              position)
+                    if attrlength < 4:
+                        break
+                    attributes[attrtype] = data[position + 4:
+                                                position + attrlength]
+                    position += (attrlength + 3) & ~3
+                # NDA_DST and NDA_LLADDR
+                if 1 in attributes and len(attributes.get(2, b"")) == 6:
+                    neighbours.append((
+                        ":".join("%02x" % byte for byte in attributes[2]),
+                        socket.inet_ntop(family, attributes[1])))
+            offset += (length + 3) & ~3
+    sock.close()
+    return neighbours
+
+
+def host_addresses():
+    """Returns {mac: {'ipv4': [...], 'ipv6': [...]}} for all containers
+    the host knows about, from the DHCP leases and the neighbour tables.
+
+    The result is cached until the first lease expires, a lease file
+    changes or NEIGHBOUR_CACHE_TIME passes."""
+    now = time.time()
+    leasefiles = sorted((leasefile, os.path.getmtime(leasefile))
+                        for leasefile in glob.glob(LEASES_PATH))
+    if (now < ADDRESS_CACHE["expires"] and
+            leasefiles == ADDRESS_CACHE["leases"]):
+        return ADDRESS_CACHE["addresses"]
+    addresses = {}
+    expires = now + NEIGHBOUR_CACHE_TIME
+    for mac, leases in read_leases().items():
+        for address, expiry in leases:
+            if expiry and expiry < now:
+                continue
+            if expiry:
+                expires = min(expires, expiry)
+            addresses.setdefault(mac, {"ipv4": [], "ipv6": []})
+            addresses[mac]["ipv4"].append(address)
+    for mac, address in read_neighbours():
+        protocol = "ipv6" if ":" in address else "ipv4"
+        addresses.setdefault(mac, {"ipv4": [], "ipv6": []})
+        if address not in addresses[mac][protocol]:
+            addresses[mac][protocol].append(address)
+    # Prefer global over link local IPv6 addresses
+    for entry in addresses.values():
+        entry["ipv6"].sort(key=lambda address: address.startswith("fe80:"))
+    ADDRESS_CACHE.update(addresses=addresses, expires=expires,
+                         leases=leasefiles)
+    return addresses
+
+
+def container_ip(cont, protocol="ipv4", interface="eth0"):
+    """Returns a container's address on an interface, or 'Unavailable'.
+
+    The address is looked up on the host by the interface's MAC address,
+    the container is only asked directly when the host doesn't know it.
+    Leases and neighbour entries outlive containers, so stopped ones have
+    no address."""
+    if not is_container_active(cont.name):
+        return "Unavailable"
+    for count in range(len(cont.network)):
+        name = cont.network[count].name or "eth%s" % (count)
+        macaddress = (cont.network[count].hwaddr or "").lower()
+        if name == interface and macaddress:
+            found = host_addresses().get(macaddress, {}).get(protocol)
+            if found:
+                return found[0]
+    try:
+        return cont.get_ips(protocol=protocol, interface=interface,
+                            timeout=0.5)[0]
+    except (TypeError, IndexError):
+        return "Unavailable"
+
+
+# Idle containers
+
+def read_freezer_state(containername):
+    """Returns THAWED, FREEZING or FROZEN, or None if not running"""
+    try:
+        return open(CGROUP_PATH + "freezer/lxc/" + containername +
+                    "/freezer.state").read().strip()
+    except IOError:
+        return None
+
+
+def sample_activity(containername):
+    """Samples cpu time, tasks and network traffic of a running container.
+
+    Returns (cpu nanoseconds, set of pids, network bytes)"""
+    try:
+        cputime = int(open(CGROUP_PATH + "cpuacct/lxc/" + containername +
+                           "/cpuacct.usage").read())
+    except (IOError, ValueError):
+        cputime = 0
+    try:
+        pids = set(open(CGROUP_PATH + "cpuset/lxc/" + containername +
+                        "/tasks").read().split())
+    except IOError:
+        pids = set()
+    # Any process in the container sees the container's network namespace
+    netbytes = 0
+    for pid in sorted(pids)[:1]:
+        try:
+            for line in open("/proc/" + pid + "/net/dev").readlines()[2:]:
+                interface, counters = line.split(":", 1)
+                if interface.strip() != "lo":
+                    counters = counters.split()
+                    netbytes += int(counters[0]) + int(counters[8])
+        except IOError:
+            pass
+    return cputime, pids, netbytes
+
+
+def is_busy(previous, current, elapsed):
+    """Compares two activity samples taken elapsed seconds apart"""
+    cputime = (current[0] - previous[0]) / 1000000000.0
+    return (cputime > IDLE_CPU_SHARE * elapsed or
+            current[1] != previous[1] or current[2] != previous[2])
+
+
+def idle_log(message):
+    """Appends a timestamped line to the idle freezing log"""
+    with open(IDLE_LOG, "a") as log:
+        log.write("%s %s\n" % (time.strftime("%Y-%m-%d %H:%M:%S"), message))
+
+
+def idle_freeze(containername, idle_time):
+    """Freezes an idle container and marks it as frozen for being idle"""
+    started = time.time()
+    if lxc.Container(containername).freeze():
+        open(IDLE_PATH + "frozen/" + containername, "w").close()
+        update_index(containername)
+        print (_("   %sinfo:%s froze %s, idle for %.0f seconds"
+                 % (CYAN, NORMAL, containername, idle_time)))
+        idle_log("froze %s idle=%.0fs took=%.3fs"
+                 % (containername, idle_time, time.time() - started))
+    else:
+        idle_log("failed to freeze %s" % (containername))
+
+
+def thaw_if_idle(containername):
+    """Unfreezes a container if it was frozen for being idle"""
+    marker = IDLE_PATH + "frozen/" + containername
+    if not os.path.exists(marker):
+        return
+    frozen_time = time.time() - os.path.getmtime(marker)
+    os.remove(marker)
+    if read_freezer_state(containername) == "THAWED":
+        return
+    print (_(" * Unfreezing idle container %s..." % (containername)))
+    started = time.time()
+    if lxc.Container(containername).unfreeze():
+        update_index(containername)
+        idle_log("thawed %s frozen=%.0fs took=%.3fs"
+                 % (containername, frozen_time, time.time() - started))
+    else:
+        print (_("   %serror:%s could not unfreeze %s, please check status"
+                 % (RED, NORMAL, containername)))
+
+
+# CPU placement
+
+def parse_cpulist(cpulist):
+    """Expands a kernel cpu list such as '0-3,8' in to a list of integers"""
+    cpus = set()
+    for part in cpulist.strip().split(","):
+        if "-" in part:
+            first, last = part.split("-")
+            cpus.update(range(int(first), int(last) + 1))
+        elif part:
+            cpus.add(int(part))
+    return sorted(cpus)
+
+
+def format_cpulist(cpus):
+    """Compresses a list of integers in to a kernel cpu list like '0-3,8'"""
+    ranges = []
+    for cpu in sorted(set(cpus)):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(first) if first == last else "%s-%s" % (first, last)
+                    for first, last in ranges)
+
+
+def read_topology(node_path=SYSFS_NODE_PATH, cpu_path=SYSFS_CPU_PATH):
+    """Reads the host cpu topology from sysfs, returns {node: [cpus]}"""
+    online = set(parse_cpulist(open(cpu_path + "online").read()))
+    topology = {}
+    for cpulist in glob.glob(node_path + "node[0-9]*/cpulist"):
+        node = int(os.path.basename(os.path.dirname(cpulist))[4:])
+        cpus = [cpu for cpu in parse_cpulist(open(cpulist).read())
+                if cpu in online]
+        if cpus:
+            topology[node] = cpus
+    # Kernels without NUMA support have no node directory at all
+    if not topology:
+        topology[0] = sorted(online)
+    return topology
+
+
+def read_placement(containername):
+    """Returns the (cpu class, weight) of a container, default is shared"""
+    try:
+        cpuclass, weight = open(PLACEMENT_PATH + containername).read().split()
+        return cpuclass, int(weight)
+    except (IOError, ValueError):
+        return "shared", 1
+
+
+def plan_placement(topology, policies):
+    """Works out the cpus and memory nodes for a set of containers.
+
+    policies maps container names to (cpu class, weight). Dedicated
+    containers get 'weight' cores to themselves, packed on to as few NUMA
+    nodes as possible, largest first. At least one core is always left over,
+    dedicated containers that don't fit are treated as shared. Shared
+    containers are then spread by weight over the cores nobody owns, each
+    kept on a single node. Returns {name: (cpus, mems)}."""
+    free = dict((node, list(cpus)) for node, cpus in topology.items())
+    plan = {}
+    shared = []
+    for name in sorted(policies, key=lambda name: (-policies[name][1], name)):
+        cpuclass, weight = policies[name]
+        if (cpuclass != "dedicated" or
+                sum(len(cpus) for cpus in free.values()) - weight < 1):
+            shared.append(name)
+            continue
+        cpus = []
+        for node in sorted(free, key=lambda node: (-len(free[node]), node)):
+            taken = free[node][:weight - len(cpus)]
+            free[node] = free[node][len(taken):]
+            cpus.extend(taken)
+            if len(cpus) == weight:
+                break
+        plan[name] = (cpus, sorted(node for node in topology
+                                   if set(topology[node]) & set(cpus)))
+    load = dict((node, 0) for node in free if free[node])
+    for name in shared:
+        node = min(load, key=lambda node: (load[node] / len(free[node]), node))
+        load[node] += policies[name][1]
+        plan[name] = (free[node], [node])
+    return plan
+
+
+def apply_placement(containername, cpus, mems=None, cgroup_path=CGROUP_PATH):
+    """Stores a container's cpuset in its config and re-pins it if active.
+
+    mems is only set on NUMA hosts, otherwise it is left to lxc."""
+    set_config_value(containername, "lxc.cgroup.cpuset.cpus",
+                     format_cpulist(cpus))
+    if mems is not None:
+        set_config_value(containername, "lxc.cgroup.cpuset.mems",
+                         format_cpulist(mems))
+    if not is_container_active(containername, cgroup_path):
+        return
+    cgroup = cgroup_path + "cpuset/lxc/" + containername + "/"
+    # mems first, so memory can follow the cpus when moving between nodes
+    for key, value in (("cpuset.mems", mems), ("cpuset.cpus", cpus)):
+        if value is not None:
+            with open(cgroup + key, "w") as cgroup_file:
+                cgroup_file.write(format_cpulist(value))
+
+
+def place_containers(containernames, cgroup_path=CGROUP_PATH,
+                     node_path=SYSFS_NODE_PATH, cpu_path=SYSFS_CPU_PATH):
+    """Balances the given and all active containers over the host cpus.
+
+    Returns the plan that was applied, see plan_placement."""
+    topology = read_topology(node_path, cpu_path)
+    names = set(containernames)
+    names.update(name for name in list_containers()
+                 if is_container_active(name, cgroup_path))
+    plan = plan_placement(topology,
+                          dict((name, read_placement(name)) for name in names))
+    for name, (cpus, mems) in plan.items():
+        apply_placement(name, cpus, mems if len(topology) > 1 else None,
+                        cgroup_path)
+    return plan
+
+
 # Tests
 
 def requires_root():
@@ -726,14 +3335,14 @@ def requires_network_bridge():
     # How many cards are configured:
     network_configurations = len(cont.network)
 
-    # Loop through them and check that they're at least kind of up
+    # Loop through them and check that their links exist
+    interfaces = os.listdir(SYSFS_NET_PATH)
     count = 0
     while count < network_configurations:
         network_bridge = cont.network[count].link
         count = count + 1
-        ifconfig_output = os.popen("ifconfig " + network_bridge)
 
-        if "Device not found" in ifconfig_output:
+        if network_bridge and network_bridge not in interfaces:
             print (_("   %serror:%s The network device %s does not seem to be"
                    " available."
                    % (RED, NORMAL, network_bridge)))
@@ -752,6 +3361,18 @@ def requires_container_existance():
         sys.exit(400)
 
 
+def requires_base_not_in_use():
+    """Prints an error message and exits if ephemeral containers use the
+    container as their base. Changing it under their overlays is
+    undefined."""
+    users = ephemerals_on(CONTAINERNAME)
+    if users:
+        print (_("   %serror:%s %s is the base of ephemeral containers %s, "
+                 "halt or kill them first"
+                 % (RED, NORMAL, CONTAINERNAME, " ".join(users))))
+        sys.exit(1)
+
+
 def requires_free_disk_space():
     """Checks whether we have anough free disk space on the LXC partition
     before proceding."""
@@ -774,8 +3395,7 @@ def requires_free_memory():
 
 def is_path_on_btrfs(path):
     """Check whether a path is on btrfs, returns true if it is"""
-    btrfs_output = os.popen("btrfs filesystem df " + path).read()
-    if "Data" in btrfs_output:
+    if filesystem_type(path) == "btrfs":
         return True
     else:
         return False
@@ -849,6 +3469,9 @@ SP_UNFREEZE.add_argument('CONTAINERNAME', type=str,
 SP_UNFREEZE.set_defaults(function=unfreeze)
 
 SP_LIST = SP.add_parser('list', help='Displays a list of containers')
+SP_LIST.add_argument('-s', '--sort', type=str, default='name',
+                     choices=['name', 'disk'],
+                     help="Sort by name, or by disk usage largest first")
 SP_LIST.set_defaults(function=listing)
 
 SP_CLONE = SP.add_parser('clone', help='Clone a container into a new one')
@@ -856,16 +3479,19 @@ SP_CLONE.add_argument('CONTAINERNAME', type=str,
                       help='Name of the container to be cloned')
 SP_CLONE.add_argument('newCONTAINERNAME', type=str,
                       help='Name of the new container to be created')
+add_io_arguments(SP_CLONE)
 SP_CLONE.set_defaults(function=clone)
 
 SP_ARCHIVE = SP.add_parser('archive', help='Archive a container')
 SP_ARCHIVE.add_argument('CONTAINERNAME', type=str,
                         help="Name of the container to be archived")
+add_io_arguments(SP_ARCHIVE)
 SP_ARCHIVE.set_defaults(function=archive)
 
 SP_UNARCHIVE = SP.add_parser('unarchive', help='Unarchive a container')
 SP_UNARCHIVE.add_argument('CONTAINERNAME', type=str,
                           help="Name of the container to be unarchived")
+add_io_arguments(SP_UNARCHIVE)
 SP_UNARCHIVE.set_defaults(function=unarchive)
 
 SP_STARTALL = SP.add_parser('startall', help='Start all stopped containers')
@@ -923,16 +3549,125 @@ SP_CONSOLE.set_defaults(function=console)
 SP_CONSOLE.add_argument('CONTAINERNAME', type=str,
                         help="Name of the container to attach console")
 
-ARGS = PARSER.parse_args()
+SP_REBALANCE = SP.add_parser('rebalance',
+                             help='Re-pin running containers to cpus')
+SP_REBALANCE.set_defaults(function=rebalance)
+
+SP_CPUCLASS = SP.add_parser('cpuclass',
+                            help='Set the cpu placement class of a container')
+SP_CPUCLASS.add_argument('CONTAINERNAME', type=str,
+                         help="Name of the container")
+SP_CPUCLASS.add_argument('cpuclass', type=str,
+                         choices=['dedicated', 'shared'],
+                         help="dedicated: cores of its own, "
+                              "shared: share the remaining cores")
+SP_CPUCLASS.add_argument('-w', '--weight', type=int, default=1,
+                         help="Cores for dedicated, share for shared")
+SP_CPUCLASS.set_defaults(function=cpuclass)
+
+SP_IDLEWATCH = SP.add_parser('idlewatch',
+                             help='Freeze containers while they are idle')
+SP_IDLEWATCH.add_argument('-t', '--threshold', type=int, default=1800,
+                          help="Seconds of idleness before freezing")
+SP_IDLEWATCH.add_argument('-i', '--interval', type=int, default=60,
+                          help="Seconds between activity samples")
+SP_IDLEWATCH.add_argument('-x', '--exclude', type=str, nargs='*', default=[],
+                          help="Containers never to freeze, in addition to "
+                               "those listed in " + IDLE_PATH + "exclude")
+SP_IDLEWATCH.set_defaults(function=idlewatch)
+
+SP_DU = SP.add_parser('du', help='Display disk usage of all containers')
+SP_DU.set_defaults(function=du)
+
+SP_BACKUP = SP.add_parser('backup',
+                          help='Back up containers, autostart and ssh keys')
+SP_BACKUP.add_argument('destination', type=str,
+                       help="Directory to back up to, an interrupted backup "
+                            "to it is resumed")
+SP_BACKUP.add_argument('containers', metavar='CONTAINERNAME', type=str,
+                       nargs='*', help="Names of the containers")
+SP_BACKUP.add_argument('-a', '--all', action='store_true',
+                       help="Back up all containers")
+SP_BACKUP.add_argument('-o', '--online', action='store_true',
+                       help="Snapshot or freeze running containers "
+                            "instead of halting them")
+SP_BACKUP.add_argument('-j', '--jobs', type=int, default=2,
+                       help="Containers to back up at the same time")
+SP_BACKUP.add_argument('-b', '--bwlimit', type=float, default=0,
+                       help="Limit in MB/s over all jobs, 0 for none")
+SP_BACKUP.add_argument('-f', '--fresh', action='store_true',
+                       help="Back up everything again instead of resuming "
+                            "an interrupted backup")
+add_io_arguments(SP_BACKUP)
+SP_BACKUP.set_defaults(function=backup)
+
+SP_RESTORE = SP.add_parser('restore',
+                           help='Restore containers from a backup')
+SP_RESTORE.add_argument('source', type=str,
+                        help="Directory holding the backup")
+SP_RESTORE.add_argument('-j', '--jobs', type=int, default=2,
+                        help="Containers to restore at the same time")
+SP_RESTORE.add_argument('-b', '--bwlimit', type=float, default=0,
+                        help="Limit in MB/s over all jobs, 0 for none")
+add_io_arguments(SP_RESTORE)
+SP_RESTORE.set_defaults(function=restore)
+
+SP_TOP = SP.add_parser('top', help='Live dashboard of all containers')
+SP_TOP.add_argument('-i', '--interval', type=float, default=2,
+                    help="Seconds between updates")
+SP_TOP.set_defaults(function=top)
+
+SP_APPLY = SP.add_parser('apply',
+                         help='Bring containers in to the state described '
+                              'by a manifest')
+SP_APPLY.add_argument('manifest', type=str,
+                      help="INI file with a [section] per container, "
+                           "with state, autostart,\ntemplate, memory, "
+                           "cpuclass, weight and depends keys")
+SP_APPLY.add_argument('-n', '--dry-run', action='store_true',
+                      help="Only print what would be done")
+SP_APPLY.add_argument('-j', '--jobs', type=int, default=4,
+                      help="Containers to change at the same time")
+SP_APPLY.set_defaults(function=apply)
+
+SP_EPHEMERAL = SP.add_parser('ephemeral',
+                             help='Start a throwaway container on a base')
+SP_EPHEMERAL.add_argument('CONTAINERNAME', type=str,
+                          help="Name of the stopped base container")
+SP_EPHEMERAL.add_argument('-n', '--name', type=str,
+                          help="Name of the new container, default is the "
+                               "base name with a random suffix")
+SP_EPHEMERAL.add_argument('-c', '--cmd', type=str, nargs=argparse.REMAINDER,
+                          help="Command to run via SSH, the container is "
+                               "removed once it's done")
+SP_EPHEMERAL.set_defaults(function=ephemeral)
+
+SP_COPYBENCH = SP.add_parser('copybench',
+                             help='Benchmark the copy engine used to clone')
+SP_COPYBENCH.add_argument('-d', '--path', type=str, default=CONTAINER_PATH,
+                          help="Directory to benchmark in, the default is "
+                               "the container path")
+SP_COPYBENCH.add_argument('-f', '--files', type=int, default=10000,
+                          help="Files in the synthetic tree")
+SP_COPYBENCH.add_argument('-s', '--size', type=int, default=64,
+                          help="Average file size in KiB")
+SP_COPYBENCH.add_argument('-j', '--jobs', type=int, default=COPY_WORKERS,
+                          help="Threads copying files")
+SP_COPYBENCH.add_argument('--cold', action='store_true',
+                          help="Drop the page cache before each copy")
+SP_COPYBENCH.set_defaults(function=copybench)
+
+if __name__ == "__main__":
+    ARGS = PARSER.parse_args()
 
-try:
-    CONTAINERNAME = ARGS.CONTAINERNAME
-except AttributeError:
-    pass
+    try:
+        CONTAINERNAME = ARGS.CONTAINERNAME
+    except AttributeError:
+        pass
 
-# Run functions
-try:
-    ARGS.function()
-except KeyboardInterrupt:
-    print (_("\n   %sinfo:%s Aborting operation, at your request"
-             % (CYAN, NORMAL)))
+    # Run functions
+    try:
+        ARGS.function()
+    except KeyboardInterrupt:
+        print (_("\n   %sinfo:%s Aborting operation, at your request"
+                 % (CYAN, NORMAL)))
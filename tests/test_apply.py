@@ -0,0 +1,162 @@
+"""Tests for 'llxc apply', run against a synthetic container and cgroup tree"""
+
+import contextlib
+import io
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+# Planning never talks to lxc, the python3-lxc bindings need not be there
+sys.modules.setdefault("lxc", types.ModuleType("lxc"))
+
+import llxc
+
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + "/"
+        self.addCleanup(shutil.rmtree, self.root)
+
+    def read(self, content):
+        with open(self.root + "manifest", "w") as manifest:
+            manifest.write(content)
+        with contextlib.redirect_stdout(io.StringIO()):
+            return llxc.read_manifest_file(self.root + "manifest")
+
+    def test_defaults_and_sizes(self):
+        manifest = self.read("[DEFAULT]\nautostart = yes\n\n"
+                             "[db]\nmemory = 512M\ncpuclass = dedicated\n"
+                             "weight = 2\n\n"
+                             "[web]\nstate = frozen\ndepends = db\n")
+        self.assertEqual(manifest["db"], {
+            "state": "running", "autostart": True, "template": "ubuntu",
+            "memory": 512 * 1024 * 1024, "cpuclass": "dedicated",
+            "weight": 2, "depends": []})
+        self.assertEqual(manifest["web"]["state"], "frozen")
+        self.assertEqual(manifest["web"]["depends"], ["db"])
+        self.assertIsNone(manifest["web"]["memory"])
+
+    def test_invalid_state(self):
+        with self.assertRaises(SystemExit):
+            self.read("[db]\nstate = sleeping\n")
+
+    def test_invalid_cpuclass(self):
+        with self.assertRaises(SystemExit):
+            self.read("[db]\ncpuclass = exclusive\n")
+
+    def test_unknown_dependency(self):
+        with self.assertRaises(SystemExit):
+            self.read("[web]\ndepends = db\n")
+
+
+class DependencyLevelsTest(unittest.TestCase):
+
+    def manifest(self, depends):
+        return dict((name, {"depends": list(dependencies)})
+                    for name, dependencies in depends.items())
+
+    def test_levels(self):
+        self.assertEqual(
+            llxc.dependency_levels(self.manifest({
+                "lb": ["web"], "web": ["db", "cache"], "db": [],
+                "cache": [], "mail": []})),
+            [["cache", "db", "mail"], ["web"], ["lb"]])
+
+    def test_cycle(self):
+        with contextlib.redirect_stdout(io.StringIO()):
+            with self.assertRaises(SystemExit):
+                llxc.dependency_levels(self.manifest({
+                    "a": ["b"], "b": ["c"], "c": ["a"], "d": []}))
+
+
+class PlanTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + "/"
+        self.addCleanup(shutil.rmtree, self.root)
+        paths = {"CONTAINER_PATH": self.root + "lxc/",
+                 "CGROUP_PATH": self.root + "cgroup/",
+                 "AUTOSTART_PATH": self.root + "auto/",
+                 "PLACEMENT_PATH": self.root + "placement/"}
+        for attribute, path in paths.items():
+            os.makedirs(path)
+            patcher = mock.patch.object(llxc, attribute, path)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def make_container(self, name, freezer=None, config=""):
+        os.makedirs(llxc.CONTAINER_PATH + name)
+        with open(llxc.CONTAINER_PATH + name + "/config", "w") as config_file:
+            config_file.write("lxc.utsname = %s\n%s" % (name, config))
+        if freezer:
+            os.makedirs(llxc.CGROUP_PATH + "freezer/lxc/" + name)
+            with open(llxc.CGROUP_PATH + "freezer/lxc/" + name +
+                      "/freezer.state", "w") as state:
+                state.write(freezer + "\n")
+
+    def entry(self, **settings):
+        entry = {"state": "running", "autostart": None, "template": "ubuntu",
+                 "memory": None, "cpuclass": None, "weight": 1,
+                 "depends": []}
+        entry.update(settings)
+        return entry
+
+    def test_absent_container(self):
+        plan = llxc.plan_changes({"web": self.entry(template="debian")})
+        self.assertEqual(plan["web"], ([], [("create", "debian"),
+                                            ("start",)]))
+
+    def test_absent_container_to_freeze(self):
+        plan = llxc.plan_changes({"web": self.entry(state="frozen")})
+        self.assertEqual(plan["web"], ([], [("create", "ubuntu"),
+                                            ("start",), ("freeze",)]))
+
+    def test_frozen_container(self):
+        self.make_container("web", freezer="FROZEN")
+        self.assertEqual(llxc.plan_changes({"web": self.entry()}),
+                         {"web": ([("unfreeze",)], [])})
+        self.assertEqual(
+            llxc.plan_changes({"web": self.entry(state="stopped")}),
+            {"web": ([("unfreeze",), ("halt",)], [])})
+
+    def test_destroy(self):
+        self.make_container("web")
+        self.assertEqual(
+            llxc.plan_changes({"web": self.entry(state="absent")}),
+            {"web": ([("destroy",)], [])})
+        self.assertEqual(
+            llxc.plan_changes({"db": self.entry(state="absent")}), {})
+
+    def test_converged_container(self):
+        self.make_container(
+            "web", freezer="THAWED",
+            config="lxc.cgroup.memory.limit_in_bytes = 512M\n")
+        os.symlink(llxc.CONTAINER_PATH + "web",
+                   llxc.AUTOSTART_PATH + "web")
+        with open(llxc.PLACEMENT_PATH + "web", "w") as placement:
+            placement.write("dedicated 2\n")
+        self.assertEqual(llxc.plan_changes({"web": self.entry(
+            memory=512 * 1024 * 1024, cpuclass="dedicated", weight=2,
+            autostart=True)}), {})
+
+    def test_configuration_changes(self):
+        self.make_container(
+            "web", freezer="THAWED",
+            config="lxc.cgroup.memory.limit_in_bytes = 512000000\n")
+        plan = llxc.plan_changes({"web": self.entry(
+            memory=512 * 1024 * 1024, cpuclass="shared", weight=3,
+            autostart=True)})
+        self.assertEqual(plan["web"], ([], [
+            ("memory", 512 * 1024 * 1024), ("cpuclass", "shared", 3),
+            ("autostart", True)]))
+
+
+if __name__ == "__main__":
+    unittest.main()
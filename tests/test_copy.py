@@ -0,0 +1,81 @@
+"""Tests for the copy engine clones use when the storage can't snapshot"""
+
+import os
+import shutil
+import stat
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+# Copying never talks to lxc, the python3-lxc bindings need not be there
+sys.modules.setdefault("lxc", types.ModuleType("lxc"))
+
+import llxc
+
+
+@unittest.skipIf(os.getuid(), "owners and device nodes need root")
+class CopyTreeTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + "/"
+        self.addCleanup(shutil.rmtree, self.root)
+        self.source = self.root + "source"
+        self.size = llxc.make_synthetic_tree(self.source, 300, 16 * 1024)
+
+    def copy(self, workers=4, methods=None):
+        progress = llxc.CopyProgress.__init__
+        if methods:
+            def restricted(copy_progress, total):
+                progress(copy_progress, total)
+                copy_progress.methods.update(methods)
+            llxc.CopyProgress.__init__ = restricted
+            self.addCleanup(setattr, llxc.CopyProgress, "__init__", progress)
+        return llxc.copy_tree(self.source, self.root + "copy", workers)
+
+    def check_copy(self, progress):
+        self.assertEqual(llxc.tree_signature(self.source),
+                         llxc.tree_signature(self.root + "copy"))
+        self.assertEqual(progress.copied, self.size)
+
+    def test_copy_file_range(self):
+        self.check_copy(self.copy())
+
+    def test_buffered(self):
+        progress = self.copy(1, {"reflink": False,
+                                 "copy_file_range": False})
+        self.check_copy(progress)
+        self.assertNotIn("copy_file_range", progress.used)
+
+    def test_special_files(self):
+        self.copy()
+        copy = self.root + "copy/"
+        self.assertTrue(stat.S_ISFIFO(os.lstat(copy + "fifo").st_mode))
+        self.assertEqual(os.lstat(copy + "null").st_rdev, os.makedev(1, 3))
+        self.assertEqual(os.lstat(copy + "00/000/file0").st_mode & 0o7777,
+                         0o4755)
+        self.assertEqual(os.lstat(copy + "00/000/file1").st_uid, 1001)
+        self.assertEqual(os.lstat(copy + "00/000/file4").st_ino,
+                         os.lstat(copy + "00/000/file4.hardlink").st_ino)
+        self.assertEqual(os.readlink(copy + "00/000/file3.link"), "file3")
+
+    def test_sparse_file(self):
+        self.copy()
+        source = os.lstat(self.source + "/sparse")
+        copy = os.lstat(self.root + "copy/sparse")
+        self.assertEqual(copy.st_size, source.st_size)
+        self.assertLess(copy.st_blocks * 512, copy.st_size)
+        with open(self.source + "/sparse", "rb") as original:
+            with open(self.root + "copy/sparse", "rb") as copied:
+                self.assertEqual(original.read(), copied.read())
+
+    def test_existing_destination(self):
+        os.mkdir(self.root + "copy")
+        with self.assertRaises(OSError):
+            self.copy()
+
+
+if __name__ == "__main__":
+    unittest.main()
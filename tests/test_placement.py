@@ -0,0 +1,142 @@
+"""Tests for cpu placement, run against a synthetic sysfs and cgroup tree"""
+
+import os
+import shutil
+import sys
+import tempfile
+import types
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+# Placement never talks to lxc, the python3-lxc bindings need not be there
+sys.modules.setdefault("lxc", types.ModuleType("lxc"))
+
+import llxc
+
+
+class CpulistTest(unittest.TestCase):
+
+    def test_parse_cpulist(self):
+        self.assertEqual(llxc.parse_cpulist("0-3,8,10-11\n"),
+                         [0, 1, 2, 3, 8, 10, 11])
+        self.assertEqual(llxc.parse_cpulist(""), [])
+
+    def test_format_cpulist(self):
+        self.assertEqual(llxc.format_cpulist([11, 0, 1, 2, 3, 8, 10]),
+                         "0-3,8,10-11")
+        self.assertEqual(llxc.format_cpulist([5]), "5")
+
+    def test_round_trip(self):
+        for cpulist in ("0", "0-1", "0,2,4", "1-3,5,7-9"):
+            self.assertEqual(
+                llxc.format_cpulist(llxc.parse_cpulist(cpulist)), cpulist)
+
+
+class PlacementTest(unittest.TestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp() + "/"
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cpu_path = self.root + "sys/devices/system/cpu/"
+        self.node_path = self.root + "sys/devices/system/node/"
+        self.cgroup_path = self.root + "cgroup/"
+        self.container_path = self.root + "lxc/"
+        self.placement_path = self.root + "placement/"
+        for path in (self.cpu_path, self.container_path,
+                     self.placement_path):
+            os.makedirs(path)
+        for attribute, value in (("CONTAINER_PATH", self.container_path),
+                                 ("PLACEMENT_PATH", self.placement_path)):
+            patcher = mock.patch.object(llxc, attribute, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def write(self, path, content):
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(path, "w") as synthetic:
+            synthetic.write(content)
+
+    def make_topology(self, online, nodes):
+        self.write(self.cpu_path + "online", online + "\n")
+        for node, cpulist in nodes.items():
+            self.write(self.node_path + "node%s/cpulist" % node,
+                       cpulist + "\n")
+
+    def make_container(self, name, active=False, placement=None):
+        self.write(self.container_path + name + "/config",
+                   "lxc.utsname = %s\n" % name)
+        if active:
+            os.makedirs(self.cgroup_path + "cpuset/lxc/" + name)
+        if placement:
+            self.write(self.placement_path + name, placement + "\n")
+
+    def read_topology(self):
+        return llxc.read_topology(self.node_path, self.cpu_path)
+
+    def test_read_topology(self):
+        self.make_topology("0-5", {0: "0-3", 1: "4-7"})
+        self.assertEqual(self.read_topology(),
+                         {0: [0, 1, 2, 3], 1: [4, 5]})
+
+    def test_read_topology_without_numa(self):
+        self.make_topology("0-3", {})
+        self.assertEqual(self.read_topology(), {0: [0, 1, 2, 3]})
+
+    def test_plan_dedicated_and_shared(self):
+        topology = {0: [0, 1, 2, 3], 1: [4, 5, 6, 7]}
+        plan = llxc.plan_placement(topology, {
+            "db": ("dedicated", 3), "web": ("shared", 1),
+            "cache": ("shared", 1)})
+        self.assertEqual(plan["db"], ([0, 1, 2], [0]))
+        shared = set(plan["web"][0]) | set(plan["cache"][0])
+        self.assertFalse(shared & set(plan["db"][0]))
+        # Shared containers are spread over the nodes, one node each
+        self.assertEqual(sorted(plan["web"][1] + plan["cache"][1]), [0, 1])
+
+    def test_plan_keeps_a_core_left(self):
+        plan = llxc.plan_placement({0: [0, 1]}, {"big": ("dedicated", 2),
+                                                  "small": ("shared", 1)})
+        self.assertEqual(plan["big"], ([0, 1], [0]))
+        self.assertEqual(plan["small"], ([0, 1], [0]))
+
+    def test_place_containers_writes_cgroups_and_configs(self):
+        self.make_topology("0-3", {0: "0-1", 1: "2-3"})
+        self.make_container("db", active=True, placement="dedicated 1")
+        self.make_container("web", active=True)
+        self.make_container("stopped")
+        for name in ("db", "web"):
+            for key in ("cpuset.cpus", "cpuset.mems"):
+                self.write(self.cgroup_path + "cpuset/lxc/%s/%s"
+                           % (name, key), "")
+        plan = llxc.place_containers([], self.cgroup_path, self.node_path,
+                                     self.cpu_path)
+        self.assertEqual(sorted(plan), ["db", "web"])
+        for name in plan:
+            cpus, mems = plan[name]
+            cgroup = self.cgroup_path + "cpuset/lxc/" + name + "/"
+            self.assertEqual(open(cgroup + "cpuset.cpus").read(),
+                             llxc.format_cpulist(cpus))
+            self.assertEqual(open(cgroup + "cpuset.mems").read(),
+                             llxc.format_cpulist(mems))
+            self.assertEqual(
+                llxc.read_config_value(name, "lxc.cgroup.cpuset.cpus"),
+                llxc.format_cpulist(cpus))
+        self.assertNotIn("cpuset", open(self.container_path +
+                                        "stopped/config").read())
+
+    def test_placing_again_keeps_one_config_line(self):
+        self.make_topology("0-1", {})
+        self.make_container("web")
+        for _attempt in range(3):
+            llxc.place_containers(["web"], self.cgroup_path, self.node_path,
+                                  self.cpu_path)
+        config = open(self.container_path + "web/config").read()
+        self.assertEqual(config.count("lxc.cgroup.cpuset.cpus"), 1)
+        self.assertNotIn("lxc.cgroup.cpuset.mems", config)
+
+
+if __name__ == "__main__":
+    unittest.main()